@@ -40,193 +40,425 @@ def configure_logging(app):
     app.logger.setLevel(log_level)
 
     # Suppress noisy loggers
-    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    werkzeug_logger = logging.getLogger("werkzeug")
+    werkzeug_logger.setLevel(logging.WARNING)
+    # Handle werkzeug records directly instead of walking up to the root
+    werkzeug_logger.propagate = False
+    werkzeug_logger.handlers = [console_handler]
+    werkzeug_logger.disabled = app.config.get("DISABLE_WERKZEUG_LOG", False)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 
+# Latest schema version. Bump this and add a step to run_migrations()
+# whenever the schema changes. Fresh databases are created by create_all()
+# and stamped at version 5, so steps after 5 must be safe to re-run.
+SCHEMA_VERSION = 13
+
+# Seconds to wait before retrying deferred initialization after it failed
+INIT_RETRY_SECONDS = 30
+
+# Column introduced by each migration, used once to work out the version of
+# databases created before the schema_version table existed
+LEGACY_MIGRATION_COLUMNS = {
+    1: ("account_mappings", "sort_order"),
+    2: ("account_mappings", "is_regex"),
+    3: ("account_mappings", "category"),
+    4: ("account_mappings", "realm_id"),
+    5: ("update_history", "realm_id"),
+}
+
+
+def detect_legacy_schema_version():
+    """Infer the schema version of a database that predates schema_version"""
+    from sqlalchemy import inspect
+
+    # One reflection pass instead of a failing SELECT (and rollback) per column
+    inspector = inspect(db.engine)
+    columns = {
+        table: {column["name"] for column in inspector.get_columns(table)}
+        for table in {table for table, _ in LEGACY_MIGRATION_COLUMNS.values()}
+    }
+
+    version = 0
+    for number, (table, column) in sorted(LEGACY_MIGRATION_COLUMNS.items()):
+        if column not in columns[table]:
+            break
+        version = number
+    return version
+
+
+def table_columns(table):
+    """Column names of a table as they are in the database right now"""
+    from sqlalchemy import inspect
+
+    return {column["name"] for column in inspect(db.engine).get_columns(table)}
+
+
+def read_schema_version():
+    """Read the recorded schema version, or None if the version table is missing"""
+    from sqlalchemy import text
+
+    try:
+        return (
+            db.session.execute(text("SELECT version FROM schema_version")).scalar() or 0
+        )
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def get_schema_version(app):
+    """Get the current schema version, creating the version table if missing"""
+    from sqlalchemy import text
+
+    version = read_schema_version()
+    if version is not None:
+        return version
+
+    version = detect_legacy_schema_version()
+    app.logger.info(f"Creating schema_version table at version {version}")
+    db.session.execute(
+        text("CREATE TABLE schema_version (version INTEGER PRIMARY KEY)")
+    )
+    db.session.execute(
+        text("INSERT INTO schema_version (version) VALUES (:version)"),
+        {"version": version},
+    )
+    db.session.commit()
+    return version
+
+
 def run_migrations(app):
     """Run database migrations for schema changes"""
     from sqlalchemy import text
 
     with app.app_context():
+        version = get_schema_version(app)
+        if version >= SCHEMA_VERSION:
+            return
+
+        app.logger.info(
+            f"Migrating database schema from version {version} to {SCHEMA_VERSION}"
+        )
+
+        # SQLite commits ALTER TABLE immediately, so columns added by an
+        # earlier failed run are still there; only add what is missing
+        mapping_columns = table_columns("account_mappings")
+
         # Migration 1: Add sort_order column
-        try:
-            result = db.session.execute(
-                text("SELECT sort_order FROM account_mappings LIMIT 1")
-            )
-            result.close()
-        except Exception:
-            app.logger.info("Adding sort_order column to account_mappings table...")
-            db.session.execute(
-                text(
-                    "ALTER TABLE account_mappings ADD COLUMN sort_order INTEGER DEFAULT 0 NOT NULL"
+        if version < 1:
+            if "sort_order" not in mapping_columns:
+                app.logger.info("Adding sort_order column to account_mappings table...")
+                db.session.execute(
+                    text(
+                        "ALTER TABLE account_mappings ADD COLUMN sort_order INTEGER DEFAULT 0 NOT NULL"
+                    )
                 )
-            )
             db.session.execute(text("UPDATE account_mappings SET sort_order = id"))
-            db.session.commit()
-            app.logger.info("Migration complete: sort_order column added")
 
         # Migration 2: Add is_regex column
-        try:
-            result = db.session.execute(
-                text("SELECT is_regex FROM account_mappings LIMIT 1")
-            )
-            result.close()
-        except Exception:
+        if version < 2 and "is_regex" not in mapping_columns:
             app.logger.info("Adding is_regex column to account_mappings table...")
             db.session.execute(
                 text(
                     "ALTER TABLE account_mappings ADD COLUMN is_regex BOOLEAN DEFAULT 0 NOT NULL"
                 )
             )
-            db.session.commit()
-            app.logger.info("Migration complete: is_regex column added")
 
         # Migration 3: Add category column
-        try:
-            result = db.session.execute(
-                text("SELECT category FROM account_mappings LIMIT 1")
-            )
-            result.close()
-        except Exception:
+        if version < 3 and "category" not in mapping_columns:
             app.logger.info("Adding category column to account_mappings table...")
             db.session.execute(
                 text("ALTER TABLE account_mappings ADD COLUMN category VARCHAR(100)")
             )
-            db.session.commit()
-            app.logger.info("Migration complete: category column added")
 
         # Migration 4: Add realm_id column for multi-company support
-        try:
-            result = db.session.execute(
-                text("SELECT realm_id FROM account_mappings LIMIT 1")
-            )
-            result.close()
-        except Exception:
+        if version < 4 and "realm_id" not in mapping_columns:
             app.logger.info(
                 "Adding realm_id column to account_mappings table for multi-company support..."
             )
             db.session.execute(
                 text("ALTER TABLE account_mappings ADD COLUMN realm_id VARCHAR(50)")
             )
-            db.session.commit()
-            app.logger.info("Migration complete: realm_id column added")
-
-            # Try to migrate existing mappings to current active connection
-            try:
-                from app.models.qbo_connection import QBOConnection
-                from app.models.db_account_mapping import DBAccountMapping
-
-                connection = QBOConnection.query.order_by(
-                    QBOConnection.updated_at.desc()
-                ).first()
-                if connection:
-                    migrated = DBAccountMapping.migrate_mappings_to_realm(
-                        connection.realm_id
-                    )
-                    if migrated > 0:
-                        app.logger.info(
-                            f"Migrated {migrated} existing mappings to realm {connection.realm_id}"
-                        )
-            except Exception as e:
-                app.logger.warning(
-                    f"Could not migrate existing mappings to realm: {str(e)}"
-                )
 
         # Migration 5: Add realm_id column to update_history for multi-company support
-        try:
-            result = db.session.execute(
-                text("SELECT realm_id FROM update_history LIMIT 1")
-            )
-            result.close()
-        except Exception:
+        if version < 5 and "realm_id" not in table_columns("update_history"):
             app.logger.info(
                 "Adding realm_id column to update_history table for multi-company support..."
             )
             db.session.execute(
                 text("ALTER TABLE update_history ADD COLUMN realm_id VARCHAR(50)")
             )
-            db.session.commit()
+
+        # Migration 6: Index the active-mappings lookup (realm, active, order)
+        if version < 6:
             app.logger.info(
-                "Migration complete: realm_id column added to update_history"
+                "Adding realm/active/sort_order index to account_mappings..."
+            )
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_mappings_realm_active_order "
+                    "ON account_mappings (realm_id, is_active, sort_order)"
+                )
             )
 
-            # Try to migrate existing history to current active connection
-            try:
-                from app.models.qbo_connection import QBOConnection
-
-                connection = QBOConnection.query.order_by(
-                    QBOConnection.updated_at.desc()
-                ).first()
-                if connection:
-                    result = db.session.execute(
-                        text(
-                            "UPDATE update_history SET realm_id = :realm_id WHERE realm_id IS NULL"
-                        ),
-                        {"realm_id": connection.realm_id},
+        # Migration 7: Replace the realm/active/order index with a partial
+        # index over active mappings only
+        if version < 7:
+            app.logger.info(
+                "Adding partial active-mappings index to account_mappings..."
+            )
+            db.session.execute(
+                text("DROP INDEX IF EXISTS ix_mappings_realm_active_order")
+            )
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_mappings_active_realm_order "
+                    "ON account_mappings (realm_id, sort_order) WHERE is_active = 1"
+                )
+            )
+
+        # Migration 8: Index history listings by realm, newest first
+        if version < 8:
+            app.logger.info("Adding realm/updated_at index to update_history...")
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_update_history_realm_updated "
+                    "ON update_history (realm_id, updated_at)"
+                )
+            )
+
+        # Migration 9: Store the lowercased pattern alongside the original
+        if version < 9:
+            if "pattern_lower" not in table_columns("account_mappings"):
+                app.logger.info(
+                    "Adding pattern_lower column to account_mappings table..."
+                )
+                db.session.execute(
+                    text(
+                        "ALTER TABLE account_mappings "
+                        "ADD COLUMN pattern_lower VARCHAR(200) DEFAULT '' NOT NULL"
                     )
-                    db.session.commit()
-                    app.logger.info(
-                        f"Migrated {result.rowcount} existing history entries to realm {connection.realm_id}"
+                )
+            # Lowercased in Python: SQLite's lower() only folds ASCII
+            rows = db.session.execute(
+                text("SELECT id, pattern FROM account_mappings")
+            ).all()
+            if rows:
+                db.session.execute(
+                    text(
+                        "UPDATE account_mappings SET pattern_lower = :lower WHERE id = :id"
+                    ),
+                    [{"id": id_, "lower": pattern.lower()} for id_, pattern in rows],
+                )
+
+        # Migration 10: Store token expiry as epoch seconds
+        if version < 10:
+            if "token_expires_at_ts" not in table_columns("qbo_connections"):
+                app.logger.info(
+                    "Adding token_expires_at_ts column to qbo_connections table..."
+                )
+                db.session.execute(
+                    text(
+                        "ALTER TABLE qbo_connections ADD COLUMN token_expires_at_ts BIGINT"
                     )
-            except Exception as e:
+                )
+            # token_expires_at is stored as naive UTC, which strftime reads as UTC
+            db.session.execute(
+                text(
+                    "UPDATE qbo_connections "
+                    "SET token_expires_at_ts = CAST(strftime('%s', token_expires_at) AS INTEGER)"
+                )
+            )
+
+        # Migration 11: Enforce unique active pattern/source account per realm
+        if version < 11:
+            app.logger.info("Adding unique active pattern index to account_mappings...")
+            # Only the first of any existing duplicates could ever match, so
+            # deactivate the rest rather than fail to build the index. IS
+            # also pairs up NULL realms, which pre-multi-company rows have
+            # until the backfill below assigns them one.
+            result = db.session.execute(
+                text(
+                    "UPDATE account_mappings SET is_active = 0 "
+                    "WHERE is_active = 1 AND EXISTS ("
+                    "SELECT 1 FROM account_mappings AS other "
+                    "WHERE other.is_active = 1 "
+                    "AND other.realm_id IS account_mappings.realm_id "
+                    "AND other.pattern = account_mappings.pattern "
+                    "AND other.from_account_id = account_mappings.from_account_id "
+                    "AND (other.sort_order, other.id) "
+                    "< (account_mappings.sort_order, account_mappings.id))"
+                )
+            )
+            if result.rowcount:
                 app.logger.warning(
-                    f"Could not migrate existing history to realm: {str(e)}"
+                    f"Deactivated {result.rowcount} duplicate active mappings"
+                )
+            db.session.execute(
+                text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_mappings_active_pattern "
+                    "ON account_mappings (realm_id, pattern, from_account_id) "
+                    "WHERE is_active = 1"
+                )
+            )
+
+        # Migration 12: Index categories per realm
+        if version < 12:
+            app.logger.info("Adding realm/category index to account_mappings...")
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_mappings_realm_category "
+                    "ON account_mappings (realm_id, category)"
+                )
+            )
+
+        # Migration 13: Index history date filters and per-account stats
+        if version < 13:
+            app.logger.info("Adding date and account indexes to update_history...")
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_update_history_realm_journal_date "
+                    "ON update_history (realm_id, journal_date)"
+                )
+            )
+            db.session.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_update_history_realm_to_account "
+                    "ON update_history (realm_id, to_account_name)"
                 )
+            )
+
+        # Assign pre-multi-company data to the current active connection. A
+        # failure rolls back and leaves the version unstamped, so the
+        # migration runs again instead of hiding the user's rows for good.
+        if version < 5:
+            try:
+                backfill_realm_ids(app, version)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Could not migrate existing data to realm: {str(e)}")
+                raise
+
+        # Schema changes, backfill and new version share one commit
+        db.session.execute(
+            text("UPDATE schema_version SET version = :version"),
+            {"version": SCHEMA_VERSION},
+        )
+        db.session.commit()
+        app.logger.info(f"Migration complete: schema at version {SCHEMA_VERSION}")
+
+
+def backfill_realm_ids(app, version):
+    """Assign rows created before multi-company support to the latest connection"""
+    from sqlalchemy import text
+    from app.models.qbo_connection import QBOConnection
+    from app.models.db_account_mapping import DBAccountMapping
+
+    connection = QBOConnection.query.order_by(QBOConnection.updated_at.desc()).first()
+    if not connection:
+        return
+
+    if version < 4:
+        migrated = DBAccountMapping.migrate_mappings_to_realm(connection.realm_id)
+        app.logger.info(
+            f"Migrated {migrated} existing mappings to realm {connection.realm_id}"
+        )
+
+    result = db.session.execute(
+        text("UPDATE update_history SET realm_id = :realm_id WHERE realm_id IS NULL"),
+        {"realm_id": connection.realm_id},
+    )
+    app.logger.info(
+        f"Migrated {result.rowcount} existing history entries to realm {connection.realm_id}"
+    )
+
+
+def configure_engine_options(app):
+    """Fit SQLALCHEMY_ENGINE_OPTIONS to the configured database URL"""
+    from sqlalchemy.engine import make_url
+
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+
+    if url.get_backend_name() == "sqlite":
+        # In-memory SQLite shares one connection (StaticPool), which rejects
+        # pool sizing
+        if url.database in (None, "", ":memory:"):
+            options.pop("pool_size", None)
+            options.pop("max_overflow", None)
+    else:
+        # check_same_thread is a sqlite3 argument other drivers reject
+        connect_args = dict(options.get("connect_args") or {})
+        connect_args.pop("check_same_thread", None)
+        options["connect_args"] = connect_args
+        # Network connections can be dropped by the server or a firewall
+        # while idle; a local SQLite file has no such failure
+        options.setdefault("pool_pre_ping", True)
+        options.setdefault("pool_recycle", 1800)
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
 
 
 def register_security_headers(app):
     """Register security headers on all responses"""
     import secrets
-    from flask import g, request
+    from flask import g
 
-    @app.before_request
-    def generate_nonce():
-        """Generate a unique nonce for each request (for CSP)"""
-        # Only generate for HTML responses (not API calls)
-        if not request.path.startswith("/api/"):
+    def get_csp_nonce():
+        """Get the request's CSP nonce, generating it on first use"""
+        # Generated lazily so only responses that render a template pay for
+        # it; API calls, redirects and static files never touch it
+        if "csp_nonce" not in g:
             g.csp_nonce = secrets.token_urlsafe(16)
+        return g.csp_nonce
 
-    @app.after_request
-    def add_security_headers(response):
+    # Headers that are identical on every response, built once
+    static_headers = {
         # Prevent MIME type sniffing
-        response.headers["X-Content-Type-Options"] = "nosniff"
+        "X-Content-Type-Options": "nosniff",
         # Prevent clickjacking
-        response.headers["X-Frame-Options"] = "SAMEORIGIN"
+        "X-Frame-Options": "SAMEORIGIN",
         # XSS protection (legacy browsers)
-        response.headers["X-XSS-Protection"] = "1; mode=block"
+        "X-XSS-Protection": "1; mode=block",
         # Referrer policy
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        "Referrer-Policy": "strict-origin-when-cross-origin",
         # Permissions policy (restrict browser features)
-        response.headers["Permissions-Policy"] = (
-            "geolocation=(), microphone=(), camera=()"
-        )
+        "Permissions-Policy": "geolocation=(), microphone=(), camera=()",
+    }
+
+    # Content Security Policy (XSS protection); only the nonce source varies
+    csp_template = (
+        "default-src 'self'; "
+        "script-src 'self'%s https://cdn.tailwindcss.com; "
+        "style-src 'self' 'unsafe-inline'; "  # Tailwind needs inline styles
+        "img-src 'self' data:; "
+        "font-src 'self'; "
+        "connect-src 'self'; "
+        "frame-ancestors 'self'; "
+        "form-action 'self'; "
+        "base-uri 'self'"
+    )
 
-        # Content Security Policy (XSS protection)
-        # Only add for HTML responses
-        if response.content_type and "text/html" in response.content_type:
-            nonce = getattr(g, "csp_nonce", "")
-            csp = "; ".join(
-                [
-                    "default-src 'self'",
-                    f"script-src 'self' 'nonce-{nonce}' https://cdn.tailwindcss.com",
-                    "style-src 'self' 'unsafe-inline'",  # Tailwind needs inline styles
-                    "img-src 'self' data:",
-                    "font-src 'self'",
-                    "connect-src 'self'",
-                    "frame-ancestors 'self'",
-                    "form-action 'self'",
-                    "base-uri 'self'",
-                ]
-            )
-            response.headers["Content-Security-Policy"] = csp
+    @app.after_request
+    def add_security_headers(response):
+        response.headers.update(static_headers)
+
+        # Only add CSP for HTML responses
+        if not (response.content_type and "text/html" in response.content_type):
+            return response
 
+        # No nonce means nothing was rendered that needs inline scripts
+        nonce = g.get("csp_nonce")
+        response.headers["Content-Security-Policy"] = csp_template % (
+            f" 'nonce-{nonce}'" if nonce else ""
+        )
         return response
 
     @app.context_processor
     def inject_csp_nonce():
         """Make nonce available in all templates"""
-        return {"csp_nonce": getattr(g, "csp_nonce", "")}
+        return {"csp_nonce": get_csp_nonce()}
 
 
 def register_error_handlers(app):
@@ -260,24 +492,19 @@ def register_error_handlers(app):
         ), 403
 
 
-def create_app(config_class=Config):
-    """Application factory"""
-    app = Flask(__name__)
-    app.config.from_object(config_class)
-
-    # Configure logging
-    configure_logging(app)
-    app.logger.info("JournalSmart starting up...")
-
-    # Initialize extensions
-    db.init_app(app)
-    csrf.init_app(app)
-
+def initialize_services(app):
+    """Create tables, run migrations and connect to QuickBooks"""
     with app.app_context():
         # Import models to ensure they're registered
         from app.models import QBOConnection, DBAccountMapping, UpdateHistory  # noqa: F401
 
-        db.create_all()
+        # A database already at the latest version has every table, so skip
+        # the per-table existence checks create_all() would run
+        if (
+            app.config.get("AUTO_CREATE_SCHEMA", True)
+            and (read_schema_version() or 0) < SCHEMA_VERSION
+        ):
+            db.create_all()
         app.logger.info(
             f"Database initialized at {app.config.get('SQLALCHEMY_DATABASE_URI')}"
         )
@@ -298,7 +525,76 @@ def create_app(config_class=Config):
         if migrated > 0:
             app.logger.info(f"Migrated {migrated} connection(s) to encrypted tokens")
 
-    # Register blueprints
+    # Refresh tokens ahead of expiry instead of on a user's request
+    interval = app.config.get("TOKEN_REFRESH_INTERVAL", 0)
+    if interval and not app.testing:
+        from app.services.qbo import qbo_service
+
+        token_service.start_background_refresh(app, qbo_service, interval)
+
+    app.logger.info("JournalSmart initialized successfully")
+
+
+def register_deferred_init(app):
+    """
+    Run initialize_services() once, on the first request that needs it.
+    Keeps app startup free of database and QuickBooks round-trips.
+    If it fails, requests get a 503 until INIT_RETRY_SECONDS have passed
+    instead of each one re-running (and re-failing) the whole setup.
+    """
+    import threading
+    import time
+    from flask import request
+
+    init_lock = threading.Lock()
+    initialized = threading.Event()
+    retry_at = 0.0
+
+    def unavailable():
+        return (
+            render_template(
+                "error.html",
+                title="Service Unavailable",
+                message="JournalSmart failed to start. Please try again shortly.",
+            ),
+            503,
+            {"Retry-After": str(INIT_RETRY_SECONDS)},
+        )
+
+    @app.before_request
+    def ensure_initialized():
+        nonlocal retry_at
+
+        # Liveness checks must answer before initialization completes
+        if initialized.is_set() or request.path.startswith("/health/"):
+            return
+
+        with init_lock:
+            if initialized.is_set():
+                return
+            if time.monotonic() < retry_at:
+                return unavailable()
+            try:
+                initialize_services(app)
+            except Exception:
+                retry_at = time.monotonic() + INIT_RETRY_SECONDS
+                app.logger.exception(
+                    f"Initialization failed; retrying in {INIT_RETRY_SECONDS}s"
+                )
+                return unavailable()
+            initialized.set()
+
+
+def register_health_routes(app):
+    """Register health check routes that don't depend on deferred init"""
+
+    @app.route("/health/live")
+    def health_live():
+        return {"status": "ok"}
+
+
+def register_blueprints(app):
+    """Register route blueprints"""
     from app.routes import journal, mapping, auth, api, history
 
     app.register_blueprint(journal.bp)
@@ -307,12 +603,57 @@ def create_app(config_class=Config):
     app.register_blueprint(api.bp)
     app.register_blueprint(history.bp)
 
+
+def create_app(config_class=Config):
+    """Application factory"""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    # Encoded once so login() can compare it in constant time
+    app.config["APP_PASSWORD_BYTES"] = (app.config.get("APP_PASSWORD") or "").encode(
+        "utf-8"
+    )
+
+    # Serialize JSON responses with orjson
+    from app.utils.json_provider import ORJSONProvider
+
+    app.json = ORJSONProvider(app)
+
+    # Keep compiled templates across restarts outside of development
+    if not app.config.get("TEMPLATES_AUTO_RELOAD"):
+        from jinja2 import FileSystemBytecodeCache
+
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+    # Configure logging
+    configure_logging(app)
+    app.logger.info("JournalSmart starting up...")
+
+    # Take the client address and scheme from trusted proxy headers
+    trusted_proxies = app.config.get("TRUSTED_PROXIES", 0)
+    if trusted_proxies:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies
+        )
+
+    # Initialize extensions
+    configure_engine_options(app)
+    db.init_app(app)
+    csrf.init_app(app)
+
+    # Database and QuickBooks setup happen on the first request
+    register_deferred_init(app)
+    register_health_routes(app)
+
+    # Register blueprints
+    register_blueprints(app)
+
     # Register error handlers
     register_error_handlers(app)
 
     # Register security headers
     register_security_headers(app)
 
-    app.logger.info("JournalSmart initialized successfully")
-
     return app
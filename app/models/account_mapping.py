@@ -6,30 +6,72 @@ Account mapping model for description-to-account rules
 
 import re
 import logging
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=4096)
+def compile_pattern(pattern: str) -> "re.Pattern":
+    """
+    Compile a mapping regex (case-insensitive). Shared process-wide, so
+    mappings with the same pattern (in any realm) reuse one compiled object
+    and a pattern validated by the API isn't compiled again when matched.
+    Raises re.error for invalid patterns (failures are not cached).
+    """
+    return re.compile(pattern, re.IGNORECASE)
+
+
 class AccountMapping:
-    def __init__(self, pattern, from_account_id, to_account_id, is_regex=False):
+    # Instances are rebuilt for every journal load; no per-instance __dict__
+    __slots__ = (
+        "_compiled",
+        "_lower",
+        "from_account_id",
+        "is_regex",
+        "pattern",
+        "to_account_id",
+    )
+
+    def __init__(
+        self,
+        pattern,
+        from_account_id,
+        to_account_id,
+        is_regex=False,
+        pattern_lower=None,
+    ):
         self.pattern = pattern
         self.from_account_id = from_account_id
         self.to_account_id = to_account_id
         self.is_regex = is_regex
 
+        # Precompile once; mappings are matched against every journal line
+        self._lower = pattern_lower or pattern.lower()
+        self._compiled = None
+        if is_regex:
+            try:
+                self._compiled = compile_pattern(pattern)
+            except re.error as e:
+                logger.warning(f"Invalid regex pattern '{pattern}': {e}")
+
     def matches(self, description):
         """Check if description matches the pattern (case-insensitive)"""
         if not description:
             return False
+        return self.matches_lowered(description, description.lower())
 
+    def matches_lowered(self, description, description_lower):
+        """
+        Like matches(), for callers testing many mappings against one
+        description that has already been lowercased
+        """
         if self.is_regex:
-            try:
-                return bool(re.search(self.pattern, description, re.IGNORECASE))
-            except re.error as e:
-                logger.warning(f"Invalid regex pattern '{self.pattern}': {e}")
+            if self._compiled is None:
                 return False
+            return self._compiled.search(description) is not None
         else:
-            return self.pattern.lower() in description.lower()
+            return self._lower in description_lower
 
     def __repr__(self):
         regex_str = ", regex=True" if self.is_regex else ""
@@ -5,17 +5,127 @@ Database model for account mapping rules
 """
 
 import re
+import time
+import hashlib
 import logging
+import threading
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session, object_session, reconstructor, validates
 from app.extensions import db
+from app.models.account_mapping import AccountMapping, compile_pattern
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
 
 logger = logging.getLogger(__name__)
 
+# Active mappings per realm: realm_id -> (loaded_at, mappings)
+# Entries are plain AccountMapping objects carrying their compiled patterns.
+_MAPPING_CACHE: Dict[Optional[str], Tuple[float, List[AccountMapping]]] = {}
+CACHE_TTL = 60  # seconds
+
+# Distinct categories per realm: realm_id -> (loaded_at, categories)
+_CATEGORY_CACHE: Dict[Optional[str], Tuple[float, List[str]]] = {}
+
+# Next sort_order to hand out per realm: realm_id -> (loaded_at, next_value)
+_SORT_ORDER_CACHE: Dict[Optional[str], Tuple[float, int]] = {}
+_sort_order_lock = threading.Lock()
+
+
+def invalidate_mapping_cache(realm_id: str = None):
+    """Drop cached active mappings for a realm, or for all realms if None"""
+    if realm_id is None:
+        _MAPPING_CACHE.clear()
+        _SORT_ORDER_CACHE.clear()
+        _CATEGORY_CACHE.clear()
+    else:
+        # Unscoped lookups (realm_id=None) include every realm
+        for key in (realm_id, None):
+            _MAPPING_CACHE.pop(key, None)
+            _SORT_ORDER_CACHE.pop(key, None)
+            _CATEGORY_CACHE.pop(key, None)
+
+
+@lru_cache(maxsize=2048)
+def _validate_pattern(pattern: str) -> tuple:
+    """Cached validate_regex(); remembers invalid patterns too"""
+    try:
+        compile_pattern(pattern)
+    except re.error as e:
+        return (False, str(e))
+    if _has_nested_repeat(sre_parse.parse(pattern)):
+        return (
+            False,
+            "nested repeats such as (a+)+ can take exponential time to match",
+        )
+    return (True, None)
+
+
+def _has_nested_repeat(parsed, in_repeat: bool = False) -> bool:
+    r"""
+    Detect a variable-length repeat inside an unbounded one, e.g. (a+)+ or
+    (\w+\s*)*. These are the shapes that backtrack catastrophically when a
+    match fails. Possessive repeats and atomic groups can't backtrack, so
+    they are not followed.
+    """
+    for op, av in parsed:
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, sub = av
+            if in_repeat and high > 1 and low != high:
+                return True
+            if _has_nested_repeat(sub, in_repeat or high == sre_constants.MAXREPEAT):
+                return True
+        elif op is sre_constants.SUBPATTERN:
+            if _has_nested_repeat(av[-1], in_repeat):
+                return True
+        elif op is sre_constants.BRANCH:
+            if any(_has_nested_repeat(branch, in_repeat) for branch in av[1]):
+                return True
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if _has_nested_repeat(av[1], in_repeat):
+                return True
+        elif op is sre_constants.GROUPREF_EXISTS:
+            if any(
+                _has_nested_repeat(branch, in_repeat) for branch in av[1:] if branch
+            ):
+                return True
+    return False
+
 
 class DBAccountMapping(db.Model):
     """Account mapping rule stored in database - scoped per QBO company"""
 
     __tablename__ = "account_mappings"
+    __table_args__ = (
+        # Serves get_active_mappings: realm lookup already in sort_order.
+        # Partial, so inactive rules don't take up space in the index.
+        db.Index(
+            "ix_mappings_active_realm_order",
+            "realm_id",
+            "sort_order",
+            sqlite_where=db.text("is_active = 1"),
+            postgresql_where=db.text("is_active"),
+        ),
+        # Serves get_categories: distinct, sorted categories straight from
+        # the index without touching the table
+        db.Index("ix_mappings_realm_category", "realm_id", "category"),
+        # At most one active rule per pattern and source account in a realm
+        db.Index(
+            "uq_mappings_active_pattern",
+            "realm_id",
+            "pattern",
+            "from_account_id",
+            unique=True,
+            sqlite_where=db.text("is_active = 1"),
+            postgresql_where=db.text("is_active"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     realm_id = db.Column(
@@ -25,6 +135,8 @@ class DBAccountMapping(db.Model):
         index=True,
     )
     pattern = db.Column(db.String(200), nullable=False)
+    # Lowercased copy of pattern, kept in sync by set_pattern_lower()
+    pattern_lower = db.Column(db.String(200), nullable=False, default="")
     from_account_id = db.Column(db.String(50), nullable=False)
     from_account_name = db.Column(db.String(200))
     to_account_id = db.Column(db.String(50), nullable=False)
@@ -47,35 +159,63 @@ class DBAccountMapping(db.Model):
     def __repr__(self):
         return f"<DBAccountMapping {self.pattern}: {self.from_account_id} -> {self.to_account_id}>"
 
+    @validates("pattern")
+    def set_pattern_lower(self, key, value):
+        self.pattern_lower = value.lower() if value else ""
+        return value
+
+    @reconstructor
+    def _on_load(self):
+        # Skip partial loads (load_only) that don't need matching; reading
+        # the deferred columns here would cost an extra SELECT
+        if "pattern" in self.__dict__ and "is_regex" in self.__dict__:
+            self._init_cache()
+
+    def _init_cache(self):
+        """Precompile the pattern once so matching doesn't re-parse it per call"""
+        self._cache_key = (self.pattern, self.is_regex)
+        self._lower = self.__dict__.get("pattern_lower") or (
+            self.pattern.lower() if self.pattern else ""
+        )
+        self._compiled = None
+        if self.is_regex:
+            try:
+                self._compiled = compile_pattern(self.pattern)
+            except re.error as e:
+                logger.warning(f"Invalid regex pattern '{self.pattern}': {e}")
+
+    def _ensure_cache(self):
+        """Rebuild the cached pattern if it was never built or has been edited"""
+        if getattr(self, "_cache_key", None) != (self.pattern, self.is_regex):
+            self._init_cache()
+
     def matches(self, description: str) -> bool:
         """Check if description matches the pattern (case-insensitive)"""
         if not description:
             return False
 
+        self._ensure_cache()
         if self.is_regex:
-            try:
-                return bool(re.search(self.pattern, description, re.IGNORECASE))
-            except re.error as e:
-                logger.warning(f"Invalid regex pattern '{self.pattern}': {e}")
+            if self._compiled is None:
                 return False
+            return self._compiled.search(description) is not None
         else:
-            return self.pattern.lower() in description.lower()
+            return self._lower in description.lower()
 
     def get_match_position(self, description: str) -> tuple:
         """Get the start and end position of the match for highlighting"""
         if not description:
             return (-1, -1)
 
+        self._ensure_cache()
         if self.is_regex:
-            try:
-                match = re.search(self.pattern, description, re.IGNORECASE)
+            if self._compiled is not None:
+                match = self._compiled.search(description)
                 if match:
                     return (match.start(), match.end())
-            except re.error:
-                pass
             return (-1, -1)
         else:
-            start = description.lower().find(self.pattern.lower())
+            start = description.lower().find(self._lower)
             if start >= 0:
                 return (start, start + len(self.pattern))
             return (-1, -1)
@@ -83,11 +223,24 @@ class DBAccountMapping(db.Model):
     @classmethod
     def validate_regex(cls, pattern: str) -> tuple:
         """Validate a regex pattern. Returns (is_valid, error_message)"""
-        try:
-            re.compile(pattern)
-            return (True, None)
-        except re.error as e:
-            return (False, str(e))
+        return _validate_pattern(pattern)
+
+    # Keys of to_dict(), also selected by get_mapping_dicts()
+    DICT_FIELDS = (
+        "id",
+        "realm_id",
+        "pattern",
+        "from_account_id",
+        "from_account_name",
+        "to_account_id",
+        "to_account_name",
+        "is_active",
+        "is_regex",
+        "category",
+        "sort_order",
+        "created_at",
+        "updated_at",
+    )
 
     def to_dict(self):
         """Convert to dictionary for API responses"""
@@ -107,23 +260,108 @@ class DBAccountMapping(db.Model):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
 
+    @classmethod
+    def get_mapping_dicts(
+        cls, realm_id: str = None, active_only: bool = False
+    ) -> List[Dict]:
+        """
+        Same result as to_dict() over a sort_order listing, built straight
+        from column rows so no ORM instances are loaded
+        """
+        stmt = select(*(getattr(cls, key) for key in cls.DICT_FIELDS)).order_by(
+            cls.sort_order.asc()
+        )
+        if realm_id:
+            stmt = stmt.where(cls.realm_id == realm_id)
+        if active_only:
+            stmt = stmt.filter_by(is_active=True)
+
+        mappings = []
+        for row in db.session.execute(stmt):
+            data = row._asdict()
+            for key in ("created_at", "updated_at"):
+                if data[key]:
+                    data[key] = data[key].isoformat()
+            mappings.append(data)
+        return mappings
+
+    @classmethod
+    def get_list_etag(cls, realm_id: str = None, active_only: bool = False) -> str:
+        """
+        Cheap fingerprint of a mapping listing: changes whenever a mapping in
+        it is added, removed or updated (every write bumps updated_at)
+        """
+        query = select(
+            db.func.count(cls.id), db.func.max(cls.updated_at), db.func.sum(cls.id)
+        )
+        if realm_id:
+            query = query.where(cls.realm_id == realm_id)
+        if active_only:
+            query = query.where(cls.is_active.is_(True))
+        count, last_updated, id_sum = db.session.execute(query).one()
+        fingerprint = f"{realm_id}:{active_only}:{count}:{last_updated}:{id_sum}"
+        return hashlib.md5(fingerprint.encode(), usedforsecurity=False).hexdigest()
+
     @classmethod
     def get_categories(cls, realm_id: str = None):
-        """Get all unique categories for a specific realm"""
-        query = cls.query.with_entities(cls.category).distinct()
-        query = query.filter(cls.category.isnot(None), cls.category != "")
+        """
+        Get all unique categories for a specific realm, sorted.
+        Cached like get_active_mappings() and invalidated on the same writes.
+        """
+        cached = _CATEGORY_CACHE.get(realm_id)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL:
+            return list(cached[1])
+
+        query = (
+            select(cls.category)
+            .where(cls.category.isnot(None), cls.category != "")
+            .distinct()
+            .order_by(cls.category)
+        )
         if realm_id:
-            query = query.filter(cls.realm_id == realm_id)
-        result = query.all()
-        return sorted([r[0] for r in result])
+            query = query.where(cls.realm_id == realm_id)
+        categories = list(db.session.scalars(query))
+
+        _CATEGORY_CACHE[realm_id] = (time.monotonic(), categories)
+        return list(categories)
 
     @classmethod
-    def get_active_mappings(cls, realm_id: str = None):
-        """Get all active mappings for a specific realm ordered by sort_order"""
-        query = cls.query.filter_by(is_active=True)
+    def get_active_mappings(cls, realm_id: str = None) -> List[AccountMapping]:
+        """
+        Get all active mappings for a specific realm ordered by sort_order,
+        as lightweight AccountMapping objects ready for matching.
+        Results are cached per realm for CACHE_TTL seconds and invalidated
+        whenever a mapping is inserted, updated or deleted.
+        """
+        cached = _MAPPING_CACHE.get(realm_id)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL:
+            return list(cached[1])
+
+        # Plain column rows: matching never needs ORM instances, so skip
+        # identity-map bookkeeping and attribute instrumentation entirely
+        stmt = select(
+            cls.pattern,
+            cls.from_account_id,
+            cls.to_account_id,
+            cls.is_regex,
+            cls.pattern_lower,
+        ).filter_by(is_active=True)
         if realm_id:
-            query = query.filter(cls.realm_id == realm_id)
-        return query.order_by(cls.sort_order.asc()).all()
+            stmt = stmt.filter(cls.realm_id == realm_id)
+        rows = db.session.execute(stmt.order_by(cls.sort_order.asc())).all()
+        mappings = [
+            AccountMapping(
+                pattern,
+                from_account_id,
+                to_account_id,
+                is_regex=bool(is_regex),
+                pattern_lower=pattern_lower,
+            )
+            for pattern, from_account_id, to_account_id, is_regex, pattern_lower in rows
+        ]
+
+        _MAPPING_CACHE[realm_id] = (time.monotonic(), mappings)
+        return list(mappings)
 
     @classmethod
     def get_mappings_by_realm(cls, realm_id: str):
@@ -134,30 +372,94 @@ class DBAccountMapping(db.Model):
 
     @classmethod
     def get_next_sort_order(cls, realm_id: str = None):
-        """Get the next available sort_order value for a realm"""
-        query = cls.query.with_entities(db.func.max(cls.sort_order))
-        if realm_id:
-            query = query.filter(cls.realm_id == realm_id)
-        max_order = query.scalar()
-        return (max_order or 0) + 1
+        """
+        Get the next available sort_order value for a realm.
+        The value is reserved in process, so callers adding several mappings
+        before flushing still get distinct values; MAX(sort_order) is only
+        re-read after a mapping change or once CACHE_TTL expires. A rollback
+        drops the reservation, so a failed insert leaves no gap.
+        """
+        with _sort_order_lock:
+            cached = _SORT_ORDER_CACHE.get(realm_id)
+            if cached and time.monotonic() - cached[0] < CACHE_TTL:
+                loaded_at, next_order = cached
+            else:
+                query = cls.query.with_entities(db.func.max(cls.sort_order))
+                if realm_id:
+                    query = query.filter(cls.realm_id == realm_id)
+                loaded_at, next_order = time.monotonic(), (query.scalar() or 0) + 1
+
+            _SORT_ORDER_CACHE[realm_id] = (loaded_at, next_order + 1)
+
+        db.session.info.setdefault("reserved_sort_order_realms", set()).add(realm_id)
+        return next_order
+
+    @classmethod
+    def insert_mappings_bulk(cls, rows: List[dict]) -> int:
+        """
+        Insert many mappings in one executemany, bypassing the unit of work.
+        Fills in pattern_lower (normally set by set_pattern_lower()) and keeps
+        the mapping caches in sync, as the mapper events would; the caller
+        commits. Rows must all have the same keys.
+        """
+        if not rows:
+            return 0
+        for row in rows:
+            row["pattern_lower"] = row["pattern"].lower()
+        db.session.execute(insert(cls), rows)
+
+        realms = {row.get("realm_id") for row in rows}
+        for realm_id in realms:
+            invalidate_mapping_cache(realm_id)
+        db.session.info.setdefault("changed_mapping_realms", set()).update(realms)
+        return len(rows)
 
     @classmethod
     def migrate_mappings_to_realm(cls, realm_id: str) -> int:
         """
         Migrate existing mappings without realm_id to the specified realm.
-        Returns the number of mappings migrated.
+        Runs in the caller's transaction; returns the number of mappings migrated.
         """
-        try:
-            orphan_mappings = cls.query.filter(cls.realm_id.is_(None)).all()
-            count = 0
-            for mapping in orphan_mappings:
-                mapping.realm_id = realm_id
-                count += 1
-            if count > 0:
-                db.session.commit()
-                logger.info(f"Migrated {count} orphan mappings to realm {realm_id}")
-            return count
-        except Exception as e:
-            logger.error(f"Error migrating mappings: {str(e)}")
-            db.session.rollback()
-            return 0
+        result = db.session.execute(
+            update(cls).where(cls.realm_id.is_(None)).values(realm_id=realm_id)
+        )
+        # Bulk UPDATE bypasses the mapper events that maintain the cache
+        invalidate_mapping_cache()
+        return result.rowcount
+
+
+@event.listens_for(DBAccountMapping, "after_insert")
+@event.listens_for(DBAccountMapping, "after_update")
+@event.listens_for(DBAccountMapping, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    """Keep the active mapping cache in sync with writes"""
+    # Include the previous realm when a mapping is moved between realms
+    realms = set(db.inspect(target).attrs.realm_id.history.sum()) or {target.realm_id}
+    for realm_id in realms:
+        invalidate_mapping_cache(realm_id)
+
+    # Invalidate again once the transaction ends, in case another request
+    # cached the old rows between this flush and the commit
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_mapping_realms", set()).update(realms)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_on_transaction_end(session):
+    for realm_id in session.info.pop("changed_mapping_realms", ()):
+        invalidate_mapping_cache(realm_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _keep_sort_order_reservations(session):
+    session.info.pop("reserved_sort_order_realms", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _release_sort_order_reservations(session):
+    """Re-read MAX(sort_order) rather than skip values a rollback left unused"""
+    with _sort_order_lock:
+        for realm_id in session.info.pop("reserved_sort_order_realms", ()):
+            _SORT_ORDER_CACHE.pop(realm_id, None)
@@ -4,10 +4,24 @@
 QuickBooks Online connection model for storing OAuth tokens
 """
 
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session, validates
 from app.extensions import db
 from app.utils.encryption import encrypt_token, decrypt_token, is_encrypted
 
+# to_dict() of every connection, newest first: (loaded_at, companies)
+_COMPANY_CACHE: Optional[Tuple[float, List[Dict]]] = None
+COMPANY_CACHE_TTL = 30  # seconds
+
+
+def invalidate_company_cache():
+    """Drop the cached company list"""
+    global _COMPANY_CACHE
+    _COMPANY_CACHE = None
+
 
 class QBOConnection(db.Model):
     """Stores QuickBooks OAuth connection details with encrypted tokens"""
@@ -23,30 +37,63 @@ class QBOConnection(db.Model):
     _refresh_token = db.Column("refresh_token", db.Text, nullable=False)
 
     token_expires_at = db.Column(db.DateTime)
+    # Same instant as Unix epoch seconds, kept in sync by set_token_expires_at()
+    token_expires_at_ts = db.Column(db.BigInteger)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(
         db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
+    @validates("token_expires_at")
+    def set_token_expires_at(self, key, value):
+        if value is None:
+            self.token_expires_at_ts = None
+        else:
+            # Naive datetimes are stored and read back as UTC
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            self.token_expires_at_ts = int(value.timestamp())
+        return value
+
     @property
     def access_token(self) -> str:
         """Decrypt and return the access token"""
-        return decrypt_token(self._access_token)
+        return self._decrypt_cached("_access_token")
 
     @access_token.setter
     def access_token(self, value: str):
         """Encrypt and store the access token"""
-        self._access_token = encrypt_token(value)
+        self._access_token = self._encrypt_cached("_access_token", value)
 
     @property
     def refresh_token(self) -> str:
         """Decrypt and return the refresh token"""
-        return decrypt_token(self._refresh_token)
+        return self._decrypt_cached("_refresh_token")
 
     @refresh_token.setter
     def refresh_token(self, value: str):
         """Encrypt and store the refresh token"""
-        self._refresh_token = encrypt_token(value)
+        self._refresh_token = self._encrypt_cached("_refresh_token", value)
+
+    def _decrypt_cached(self, column: str) -> str:
+        """
+        Decrypt a token column, memoized per instance. The plaintext is keyed
+        by the ciphertext it came from, so a reload or reassignment of the
+        column is picked up on the next access.
+        """
+        encrypted = getattr(self, column)
+        cached = self.__dict__.get(f"{column}_plain")
+        if cached is not None and cached[0] == encrypted:
+            return cached[1]
+        plain = decrypt_token(encrypted)
+        self.__dict__[f"{column}_plain"] = (encrypted, plain)
+        return plain
+
+    def _encrypt_cached(self, column: str, value: str) -> str:
+        """Encrypt a token, remembering the plaintext for later reads"""
+        encrypted = encrypt_token(value)
+        self.__dict__[f"{column}_plain"] = (encrypted, value)
+        return encrypted
 
     @property
     def tokens_encrypted(self) -> bool:
@@ -56,11 +103,11 @@ class QBOConnection(db.Model):
     def __repr__(self):
         return f"<QBOConnection {self.realm_id}: {self.company_name}>"
 
-    def is_token_expired(self) -> bool:
-        """Check if the access token is expired"""
-        if not self.token_expires_at:
+    def is_token_expired(self, buffer_seconds: int = 0) -> bool:
+        """Check if the access token is expired (or expires within buffer_seconds)"""
+        if not self.token_expires_at_ts:
             return True
-        return datetime.utcnow() >= self.token_expires_at
+        return time.time() >= self.token_expires_at_ts - buffer_seconds
 
     def to_dict(self):
         """Convert to dictionary (excludes sensitive tokens)"""
@@ -75,3 +122,41 @@ class QBOConnection(db.Model):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "tokens_encrypted": self.tokens_encrypted,
         }
+
+    @classmethod
+    def get_all_dicts(cls) -> List[Dict]:
+        """
+        to_dict() of every connection, most recently updated first.
+        Cached for COMPANY_CACHE_TTL seconds and dropped on any connection write.
+        """
+        global _COMPANY_CACHE
+        cached = _COMPANY_CACHE
+        if cached and time.monotonic() - cached[0] < COMPANY_CACHE_TTL:
+            return list(cached[1])
+
+        connections = cls.query.order_by(cls.updated_at.desc()).all()
+        companies = [conn.to_dict() for conn in connections]
+
+        _COMPANY_CACHE = (time.monotonic(), companies)
+        return list(companies)
+
+
+@event.listens_for(QBOConnection, "after_insert")
+@event.listens_for(QBOConnection, "after_update")
+@event.listens_for(QBOConnection, "after_delete")
+def _invalidate_on_change(mapper, connection, target):
+    """Keep the company list cache in sync with writes"""
+    invalidate_company_cache()
+
+    # Invalidate again once the transaction ends, in case another request
+    # cached the old rows between this flush and the commit
+    session = object_session(target)
+    if session is not None:
+        session.info["companies_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_on_transaction_end(session):
+    if session.info.pop("companies_changed", False):
+        invalidate_company_cache()
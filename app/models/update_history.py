@@ -4,14 +4,49 @@
 Model for tracking journal entry update history
 """
 
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event, func, insert, select, tuple_
+from sqlalchemy.orm import Session
 from app.extensions import db
 
+# Filtered history counts: (realm_id, journal_id, from_date, to_date) ->
+# (counted_at, total). Paging through the history page repeats the same count.
+_COUNT_CACHE: Dict[tuple, Tuple[float, int]] = {}
+COUNT_CACHE_TTL = 30  # seconds
+
+# Dashboard statistics per realm: realm_id -> (computed_at, stats)
+_STATS_CACHE: Dict[Optional[str], Tuple[float, dict]] = {}
+STATS_CACHE_TTL = 60  # seconds
+
+
+def invalidate_history_cache():
+    """Drop cached history counts and statistics after new entries are logged"""
+    _COUNT_CACHE.clear()
+    _STATS_CACHE.clear()
+
+
+def _history_changed():
+    """Invalidate now and again once the session's transaction ends"""
+    invalidate_history_cache()
+    # Another request may count the old rows between now and the commit
+    db.session.info["history_changed"] = True
+
 
 class UpdateHistory(db.Model):
     """Audit log for journal entry updates - scoped per QBO company"""
 
     __tablename__ = "update_history"
+    __table_args__ = (
+        # Serves per-realm listings newest first (SQLite appends the rowid id,
+        # which makes the index cover the (updated_at, id) keyset too)
+        db.Index("ix_update_history_realm_updated", "realm_id", "updated_at"),
+        # Journal date range filters on the history page
+        db.Index("ix_update_history_realm_journal_date", "realm_id", "journal_date"),
+        # Per-destination-account counts in the stats
+        db.Index("ix_update_history_realm_to_account", "realm_id", "to_account_name"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     realm_id = db.Column(
@@ -40,6 +75,22 @@ class UpdateHistory(db.Model):
         backref=db.backref("history", lazy="dynamic", cascade="all, delete-orphan"),
     )
 
+    # Keys of to_dict(), in order; each is a column of the same name
+    DICT_FIELDS = (
+        "id",
+        "realm_id",
+        "journal_id",
+        "journal_date",
+        "line_description",
+        "from_account_id",
+        "from_account_name",
+        "to_account_id",
+        "to_account_name",
+        "amount",
+        "mapping_id",
+        "updated_at",
+    )
+
     def __repr__(self):
         return f"<UpdateHistory Journal:{self.journal_id} {self.from_account_name} -> {self.to_account_name}>"
 
@@ -62,6 +113,44 @@ class UpdateHistory(db.Model):
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
 
+    @classmethod
+    def select_dict_fields(cls):
+        """SELECT of the to_dict() columns, for listings that skip the ORM"""
+        return select(*(getattr(cls, key) for key in cls.DICT_FIELDS))
+
+    @staticmethod
+    def row_to_dict(row) -> dict:
+        """Same result as to_dict(), from a select_dict_fields() row"""
+        data = row._asdict()
+        for key in ("journal_date", "updated_at"):
+            if data[key]:
+                data[key] = data[key].isoformat()
+        return data
+
+    @classmethod
+    def after_cursor(cls, cursor: str):
+        """
+        Filter for the entries after a next_cursor, for listings ordered by
+        (updated_at, id) descending. Keyset paging seeks past the previous
+        page instead of skipping rows, so deep pages cost the same as the
+        first. Raises ValueError for a malformed cursor.
+        """
+        cursor_at, cursor_id = cursor.rsplit("_", 1)
+        cursor_id = int(cursor_id)
+        # SQLite sorts NULL timestamps last when descending, and they never
+        # compare in a tuple, so they get their own terms
+        if not cursor_at:
+            return cls.updated_at.is_(None) & (cls.id < cursor_id)
+        before = (datetime.fromisoformat(cursor_at), cursor_id)
+        return (tuple_(cls.updated_at, cls.id) < tuple_(*before)) | (
+            cls.updated_at.is_(None)
+        )
+
+    @staticmethod
+    def cursor_for(entry: dict) -> str:
+        """next_cursor continuing after a serialized entry"""
+        return f"{entry['updated_at'] or ''}_{entry['id']}"
+
     @classmethod
     def log_update(
         cls,
@@ -76,22 +165,64 @@ class UpdateHistory(db.Model):
     ):
         """Create a new history entry for a specific realm"""
         entry = cls(
-            realm_id=realm_id,
-            journal_id=journal_id,
-            journal_date=journal_date,
-            line_description=line_description,
-            from_account_id=from_account.get("id"),
-            from_account_name=from_account.get("name"),
-            to_account_id=to_account.get("id"),
-            to_account_name=to_account.get("name"),
-            amount=amount,
-            mapping_id=mapping_id,
+            **cls.entry_values(
+                journal_id=journal_id,
+                journal_date=journal_date,
+                line_description=line_description,
+                from_account=from_account,
+                to_account=to_account,
+                amount=amount,
+                mapping_id=mapping_id,
+                realm_id=realm_id,
+            )
         )
         db.session.add(entry)
+        _history_changed()
         return entry
 
+    @staticmethod
+    def entry_values(
+        journal_id: str,
+        journal_date,
+        line_description: str,
+        from_account: dict,
+        to_account: dict,
+        amount: float = None,
+        mapping_id: int = None,
+        realm_id: str = None,
+    ) -> dict:
+        """Column values for a history entry, as accepted by log_updates_bulk()"""
+        return {
+            "realm_id": realm_id,
+            "journal_id": journal_id,
+            "journal_date": journal_date,
+            "line_description": line_description,
+            "from_account_id": from_account.get("id"),
+            "from_account_name": from_account.get("name"),
+            "to_account_id": to_account.get("id"),
+            "to_account_name": to_account.get("name"),
+            "amount": amount,
+            "mapping_id": mapping_id,
+        }
+
+    @classmethod
+    def log_updates_bulk(cls, entries: List[dict]) -> int:
+        """
+        Insert many history entries in one executemany, bypassing the unit of
+        work. Takes dicts from entry_values(); the caller commits.
+        """
+        if entries:
+            db.session.execute(insert(cls), entries)
+            _history_changed()
+        return len(entries)
+
     @classmethod
-    def get_history_by_realm(cls, realm_id: str, limit: int = 50, offset: int = 0):
+    def get_history_by_realm(
+        cls,
+        realm_id: str,
+        limit: int = 50,
+        offset: int = 0,
+    ):
         """Get history entries for a specific realm"""
         query = cls.query.filter_by(realm_id=realm_id)
         return query.order_by(cls.updated_at.desc()).offset(offset).limit(limit).all()
@@ -100,3 +231,123 @@ class UpdateHistory(db.Model):
     def get_history_count_by_realm(cls, realm_id: str) -> int:
         """Get total history count for a specific realm"""
         return cls.query.filter_by(realm_id=realm_id).count()
+
+    @classmethod
+    def has_history(cls, realm_id: str) -> bool:
+        """Whether a realm has any history; stops at the first row"""
+        return db.session.scalar(
+            select(select(cls.id).where(cls.realm_id == realm_id).exists())
+        )
+
+    @classmethod
+    def count_filtered(
+        cls,
+        realm_id: str = None,
+        journal_id: str = None,
+        from_date: str = None,
+        to_date: str = None,
+    ) -> int:
+        """
+        Count history entries matching the history page filters.
+        Cached for COUNT_CACHE_TTL seconds and dropped when entries are logged.
+        """
+        key = (realm_id, journal_id, from_date, to_date)
+        cached = _COUNT_CACHE.get(key)
+        if cached and time.monotonic() - cached[0] < COUNT_CACHE_TTL:
+            return cached[1]
+
+        query = select(func.count(cls.id))
+        if realm_id:
+            query = query.where(cls.realm_id == realm_id)
+        if journal_id:
+            query = query.where(cls.journal_id == journal_id)
+        if from_date:
+            query = query.where(cls.journal_date >= from_date)
+        if to_date:
+            query = query.where(cls.journal_date <= to_date)
+        total = db.session.scalar(query)
+
+        _COUNT_CACHE[key] = (time.monotonic(), total)
+        return total
+
+    @classmethod
+    def get_stats(cls, realm_id: str = None) -> dict:
+        """
+        Dashboard statistics for a realm: totals, top destination accounts
+        and the last 7 days of activity. Cached for STATS_CACHE_TTL seconds
+        and dropped when entries are logged.
+        """
+        cached = _STATS_CACHE.get(realm_id)
+        if cached and time.monotonic() - cached[0] < STATS_CACHE_TTL:
+            return cached[1]
+
+        # updated_at is stored as naive UTC, so the boundaries are taken in
+        # UTC too; local time would shift the month and week by the offset
+        now = datetime.utcnow()
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        week_ago = now - timedelta(days=7)
+
+        # Total updates and updates this month, counted in one pass
+        totals_query = db.session.query(
+            func.count(cls.id),
+            func.count(cls.id).filter(cls.updated_at >= month_start),
+        )
+        if realm_id:
+            totals_query = totals_query.filter(cls.realm_id == realm_id)
+        total_updates, updates_this_month = totals_query.one()
+
+        if not total_updates:
+            # Nothing to break down, so skip the grouped queries
+            stats = {
+                "total_updates": 0,
+                "updates_this_month": 0,
+                "top_accounts": [],
+                "daily_updates": [],
+            }
+            _STATS_CACHE[realm_id] = (time.monotonic(), stats)
+            return stats
+
+        # Updates by destination account (top 5)
+        account_query = db.session.query(
+            cls.to_account_name, func.count(cls.id).label("count")
+        )
+        if realm_id:
+            account_query = account_query.filter(cls.realm_id == realm_id)
+        updates_by_account = (
+            account_query.group_by(cls.to_account_name)
+            .order_by(func.count(cls.id).desc())
+            .limit(5)
+            .all()
+        )
+
+        # Recent activity (last 7 days by day)
+        daily_query = db.session.query(
+            func.date(cls.updated_at).label("date"),
+            func.count(cls.id).label("count"),
+        ).filter(cls.updated_at >= week_ago)
+        if realm_id:
+            daily_query = daily_query.filter(cls.realm_id == realm_id)
+        daily_updates = (
+            daily_query.group_by(func.date(cls.updated_at))
+            .order_by(func.date(cls.updated_at))
+            .all()
+        )
+
+        stats = {
+            "total_updates": total_updates,
+            "updates_this_month": updates_this_month,
+            "top_accounts": [
+                {"account": acc, "count": cnt} for acc, cnt in updates_by_account if acc
+            ],
+            "daily_updates": [{"date": str(d), "count": c} for d, c in daily_updates],
+        }
+
+        _STATS_CACHE[realm_id] = (time.monotonic(), stats)
+        return stats
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_on_transaction_end(session):
+    if session.info.pop("history_changed", False):
+        invalidate_history_cache()
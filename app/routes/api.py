@@ -7,22 +7,47 @@ CSRF protection: All POST/PUT/DELETE requests require X-CSRFToken header.
 The token is automatically added by main.js fetch override.
 """
 
+import os
 import logging
-from flask import Blueprint, jsonify, request
+from datetime import datetime, timedelta
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 from app.extensions import db
-from app.models.db_account_mapping import DBAccountMapping
+from app.models.account_mapping import compile_pattern
+from app.models.db_account_mapping import DBAccountMapping, invalidate_mapping_cache
+from app.models.qbo_connection import QBOConnection
+from app.models.update_history import UpdateHistory
 from app.services.qbo import qbo_service
+from app.utils.context import current_realm_id
 from app.utils.decorators import require_qbo_auth
 
 bp = Blueprint("api", __name__, url_prefix="/api")
 logger = logging.getLogger(__name__)
 
+DUPLICATE_MAPPING_ERROR = (
+    "A mapping with this pattern and source account already exists"
+)
 
-def get_current_realm_id():
-    """Get the current realm_id from the QBO service"""
-    if qbo_service.auth_client and qbo_service.auth_client.realm_id:
-        return qbo_service.auth_client.realm_id
-    return None
+# Matches the account_mappings.pattern column size
+MAX_PATTERN_LENGTH = 200
+
+# Mappings reordered per UPDATE statement (three bound parameters each)
+REORDER_BATCH_SIZE = 300
+
+# Matching lines returned by the pattern test endpoint
+MAX_TEST_MATCHES = 50
+
+# Rows fetched and written per chunk when streaming an export
+EXPORT_BATCH_SIZE = 500
 
 
 # =============================================================================
@@ -35,31 +60,30 @@ def get_current_realm_id():
 def list_mappings():
     """Get all account mappings for current company ordered by sort_order"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         # Get optional filter parameters
         active_only = request.args.get("active", "true").lower() == "true"
 
-        query = DBAccountMapping.query.order_by(DBAccountMapping.sort_order.asc())
+        # Let clients revalidate without the rows being loaded or serialized
+        etag = DBAccountMapping.get_list_etag(realm_id, active_only)
+        if etag in request.if_none_match:
+            return "", 304, {"ETag": f'"{etag}"'}
 
         # Filter by realm_id (current company)
-        if realm_id:
-            query = query.filter(DBAccountMapping.realm_id == realm_id)
-
-        if active_only:
-            query = query.filter_by(is_active=True)
-
-        mappings = query.all()
+        mappings = DBAccountMapping.get_mapping_dicts(realm_id, active_only)
 
         logger.debug(f"Retrieved {len(mappings)} mappings for realm {realm_id}")
 
-        return jsonify(
+        response = jsonify(
             {
                 "success": True,
-                "mappings": [m.to_dict() for m in mappings],
+                "mappings": mappings,
                 "count": len(mappings),
                 "realm_id": realm_id,
             }
         )
+        response.set_etag(etag)
+        return response
 
     except Exception as e:
         logger.error(f"Error listing mappings: {str(e)}")
@@ -71,7 +95,7 @@ def list_mappings():
 def create_mapping():
     """Create a new account mapping for current company"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         data = request.json
 
         if not data:
@@ -83,22 +107,11 @@ def create_mapping():
             if field not in data or not data[field]:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
 
-        # Check for duplicate pattern with same from_account_id within current realm
-        query = DBAccountMapping.query.filter_by(
-            pattern=data["pattern"],
-            from_account_id=data["from_account_id"],
-            is_active=True,
-        )
-        if realm_id:
-            query = query.filter(DBAccountMapping.realm_id == realm_id)
-        existing = query.first()
-
-        if existing:
+        # Cheap structural checks before anything touches the database
+        if len(data["pattern"]) > MAX_PATTERN_LENGTH:
             return jsonify(
-                {
-                    "error": "A mapping with this pattern and source account already exists"
-                }
-            ), 409
+                {"error": f"Pattern must be {MAX_PATTERN_LENGTH} characters or less"}
+            ), 400
 
         # Validate regex pattern if is_regex is true
         is_regex = data.get("is_regex", False)
@@ -107,7 +120,8 @@ def create_mapping():
             if not is_valid:
                 return jsonify({"error": f"Invalid regex pattern: {error}"}), 400
 
-        # Create new mapping with next sort_order for this realm
+        # Create new mapping with next sort_order for this realm. Duplicates
+        # are rejected by the uq_mappings_active_pattern index on commit.
         mapping = DBAccountMapping(
             realm_id=realm_id,
             pattern=data["pattern"],
@@ -130,6 +144,10 @@ def create_mapping():
 
         return jsonify({"success": True, "mapping": mapping.to_dict()}), 201
 
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": DUPLICATE_MAPPING_ERROR}), 409
+
     except Exception as e:
         logger.error(f"Error creating mapping: {str(e)}")
         db.session.rollback()
@@ -141,8 +159,8 @@ def create_mapping():
 def get_mapping(mapping_id):
     """Get a specific mapping by ID"""
     try:
-        realm_id = get_current_realm_id()
-        mapping = DBAccountMapping.query.get(mapping_id)
+        realm_id = current_realm_id()
+        mapping = db.session.get(DBAccountMapping, mapping_id)
 
         if not mapping:
             return jsonify({"error": "Mapping not found"}), 404
@@ -163,8 +181,8 @@ def get_mapping(mapping_id):
 def update_mapping(mapping_id):
     """Update an existing mapping"""
     try:
-        realm_id = get_current_realm_id()
-        mapping = DBAccountMapping.query.get(mapping_id)
+        realm_id = current_realm_id()
+        mapping = db.session.get(DBAccountMapping, mapping_id)
 
         if not mapping:
             return jsonify({"error": "Mapping not found"}), 404
@@ -178,10 +196,14 @@ def update_mapping(mapping_id):
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
-        # Validate regex pattern if changing to regex mode
+        # Validate regex pattern only if it changed or regex mode was turned on
         is_regex = data.get("is_regex", mapping.is_regex)
         pattern = data.get("pattern", mapping.pattern)
-        if is_regex and ("is_regex" in data or "pattern" in data):
+        if pattern and len(pattern) > MAX_PATTERN_LENGTH:
+            return jsonify(
+                {"error": f"Pattern must be {MAX_PATTERN_LENGTH} characters or less"}
+            ), 400
+        if is_regex and (pattern != mapping.pattern or not mapping.is_regex):
             is_valid, error = DBAccountMapping.validate_regex(pattern)
             if not is_valid:
                 return jsonify({"error": f"Invalid regex pattern: {error}"}), 400
@@ -210,6 +232,10 @@ def update_mapping(mapping_id):
 
         return jsonify({"success": True, "mapping": mapping.to_dict()})
 
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": DUPLICATE_MAPPING_ERROR}), 409
+
     except Exception as e:
         logger.error(f"Error updating mapping {mapping_id}: {str(e)}")
         db.session.rollback()
@@ -221,8 +247,13 @@ def update_mapping(mapping_id):
 def delete_mapping(mapping_id):
     """Delete a mapping"""
     try:
-        realm_id = get_current_realm_id()
-        mapping = DBAccountMapping.query.get(mapping_id)
+        realm_id = current_realm_id()
+        # Only the key and realm are needed to check ownership and delete
+        mapping = db.session.get(
+            DBAccountMapping,
+            mapping_id,
+            options=[load_only(DBAccountMapping.id, DBAccountMapping.realm_id)],
+        )
 
         if not mapping:
             return jsonify({"error": "Mapping not found"}), 404
@@ -249,24 +280,42 @@ def delete_mapping(mapping_id):
 def toggle_mapping(mapping_id):
     """Toggle a mapping's active status"""
     try:
-        realm_id = get_current_realm_id()
-        mapping = DBAccountMapping.query.get(mapping_id)
+        realm_id = current_realm_id()
+
+        # Flip and read back in one statement; the realm check is part of
+        # the WHERE clause so no separate SELECT is needed
+        stmt = (
+            update(DBAccountMapping)
+            .where(DBAccountMapping.id == mapping_id)
+            .values(is_active=~DBAccountMapping.is_active)
+            .returning(DBAccountMapping)
+        )
+        if realm_id:
+            stmt = stmt.where(
+                or_(
+                    DBAccountMapping.realm_id.is_(None),
+                    DBAccountMapping.realm_id == realm_id,
+                )
+            )
+        mapping = db.session.execute(stmt).scalar_one_or_none()
 
         if not mapping:
             return jsonify({"error": "Mapping not found"}), 404
 
-        # Verify mapping belongs to current realm
-        if realm_id and mapping.realm_id and mapping.realm_id != realm_id:
-            return jsonify({"error": "Mapping not found"}), 404
-
-        mapping.is_active = not mapping.is_active
+        # Serialize before commit expires the returned row
+        mapping_dict = mapping.to_dict()
         db.session.commit()
+        invalidate_mapping_cache(mapping_dict["realm_id"])
 
         logger.info(
-            f"Toggled mapping {mapping_id} to {'active' if mapping.is_active else 'inactive'}"
+            f"Toggled mapping {mapping_id} to {'active' if mapping_dict['is_active'] else 'inactive'}"
         )
 
-        return jsonify({"success": True, "mapping": mapping.to_dict()})
+        return jsonify({"success": True, "mapping": mapping_dict})
+
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": DUPLICATE_MAPPING_ERROR}), 409
 
     except Exception as e:
         logger.error(f"Error toggling mapping {mapping_id}: {str(e)}")
@@ -279,7 +328,7 @@ def toggle_mapping(mapping_id):
 def reorder_mappings():
     """Reorder mappings by updating their sort_order values"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         data = request.json
 
         if not data or "order" not in data:
@@ -287,19 +336,44 @@ def reorder_mappings():
 
         order = data["order"]
 
-        if not isinstance(order, list):
+        if not isinstance(order, list) or not all(
+            isinstance(mapping_id, int) and not isinstance(mapping_id, bool)
+            for mapping_id in order
+        ):
             return jsonify({"error": "Order must be an array of mapping IDs"}), 400
 
-        # Update sort_order for each mapping (only if it belongs to current realm)
-        for index, mapping_id in enumerate(order):
-            mapping = DBAccountMapping.query.get(mapping_id)
-            if mapping:
-                # Verify realm ownership
-                if realm_id and mapping.realm_id and mapping.realm_id != realm_id:
-                    continue
-                mapping.sort_order = index
+        # Later positions win if an ID is repeated
+        positions = {mapping_id: index for index, mapping_id in enumerate(order)}
+        mapping_ids = list(positions)
+
+        # One UPDATE ... CASE per batch instead of a SELECT and UPDATE per
+        # mapping; batches keep bound parameters under SQLite's limit
+        for start in range(0, len(mapping_ids), REORDER_BATCH_SIZE):
+            batch = mapping_ids[start : start + REORDER_BATCH_SIZE]
+            stmt = (
+                update(DBAccountMapping)
+                .where(DBAccountMapping.id.in_(batch))
+                .values(
+                    sort_order=case(
+                        {mapping_id: positions[mapping_id] for mapping_id in batch},
+                        value=DBAccountMapping.id,
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+            # Only touch mappings that belong to the current realm (or none)
+            if realm_id:
+                stmt = stmt.where(
+                    or_(
+                        DBAccountMapping.realm_id.is_(None),
+                        DBAccountMapping.realm_id == realm_id,
+                    )
+                )
+            db.session.execute(stmt)
 
         db.session.commit()
+        # Bulk UPDATE bypasses the mapper events that maintain the cache
+        invalidate_mapping_cache(realm_id)
 
         logger.info(f"Reordered {len(order)} mappings for realm {realm_id}")
 
@@ -320,10 +394,6 @@ def reorder_mappings():
 @require_qbo_auth
 def test_pattern():
     """Test a pattern against recent journal entries"""
-    from app.services.qbo import qbo_service
-    from datetime import datetime, timedelta
-    import re
-
     try:
         data = request.json
 
@@ -354,8 +424,12 @@ def test_pattern():
             from_account_id, start_date
         )
 
-        # Test pattern against journal descriptions
+        # Test pattern against journal descriptions. Every match is counted
+        # but only the first MAX_TEST_MATCHES are kept for the response.
         matches = []
+        total_matches = 0
+        pattern_lower = pattern.lower()
+        compiled = compile_pattern(pattern) if is_regex else None
 
         for journal in journals:
             for line in journal.get("lines", []):
@@ -368,22 +442,24 @@ def test_pattern():
                 match_end = -1
 
                 if is_regex:
-                    try:
-                        match = re.search(pattern, description, re.IGNORECASE)
-                        if match:
-                            match_found = True
-                            match_start = match.start()
-                            match_end = match.end()
-                    except re.error:
-                        pass
+                    match = compiled.search(description)
+                    if match:
+                        match_found = True
+                        match_start = match.start()
+                        match_end = match.end()
                 else:
-                    pattern_lower = pattern.lower()
-                    if pattern_lower in description.lower():
+                    description_lower = line.get("description_lower")
+                    if description_lower is None:
+                        description_lower = description.lower()
+                    match_start = description_lower.find(pattern_lower)
+                    if match_start >= 0:
                         match_found = True
-                        match_start = description.lower().find(pattern_lower)
                         match_end = match_start + len(pattern)
 
-                if match_found:
+                if not match_found:
+                    continue
+                total_matches += 1
+                if len(matches) < MAX_TEST_MATCHES:
                     matches.append(
                         {
                             "journal_id": journal.get("id"),
@@ -397,7 +473,7 @@ def test_pattern():
                     )
 
         logger.debug(
-            f"Pattern '{pattern}' (regex={is_regex}) matched {len(matches)} lines"
+            f"Pattern '{pattern}' (regex={is_regex}) matched {total_matches} lines"
         )
 
         return jsonify(
@@ -405,9 +481,9 @@ def test_pattern():
                 "success": True,
                 "pattern": pattern,
                 "is_regex": is_regex,
-                "matches": matches[:50],  # Limit to 50 results
-                "total_matches": len(matches),
-                "truncated": len(matches) > 50,
+                "matches": matches,
+                "total_matches": total_matches,
+                "truncated": total_matches > MAX_TEST_MATCHES,
             }
         )
 
@@ -441,7 +517,7 @@ def validate_regex():
 def get_categories():
     """Get all unique mapping categories for current company"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         categories = DBAccountMapping.get_categories(realm_id)
 
         return jsonify({"success": True, "categories": categories})
@@ -461,7 +537,7 @@ def get_categories():
 def import_mappings():
     """Import mappings from JSON array for current company"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         data = request.json
 
         if not data or not isinstance(data, list):
@@ -471,6 +547,15 @@ def import_mappings():
         skipped = 0
         errors = []
 
+        # Existing pattern/account pairs within current realm, fetched once
+        query = db.session.query(
+            DBAccountMapping.pattern, DBAccountMapping.from_account_id
+        )
+        if realm_id:
+            query = query.filter(DBAccountMapping.realm_id == realm_id)
+        existing = set(query.all())
+        new_mappings = []
+
         for idx, mapping_data in enumerate(data):
             # Validate required fields
             if not all(
@@ -492,36 +577,33 @@ def import_mappings():
                     errors.append(f"Item {idx}: Invalid regex - {error}")
                     continue
 
-            # Check for existing within current realm
-            query = DBAccountMapping.query.filter_by(
-                pattern=mapping_data["pattern"],
-                from_account_id=mapping_data["from_account_id"],
-            )
-            if realm_id:
-                query = query.filter(DBAccountMapping.realm_id == realm_id)
-            existing = query.first()
-
-            if existing:
+            # Check for existing within current realm (or earlier in this import)
+            key = (mapping_data["pattern"], mapping_data["from_account_id"])
+            if key in existing:
                 skipped += 1
                 errors.append(f"Item {idx}: Duplicate pattern/account")
                 continue
+            existing.add(key)
 
             # Create new mapping for current realm
-            mapping = DBAccountMapping(
-                realm_id=realm_id,
-                pattern=mapping_data["pattern"],
-                from_account_id=mapping_data["from_account_id"],
-                from_account_name=mapping_data.get("from_account_name"),
-                to_account_id=mapping_data["to_account_id"],
-                to_account_name=mapping_data.get("to_account_name"),
-                is_active=mapping_data.get("is_active", True),
-                is_regex=is_regex,
-                category=(mapping_data.get("category") or "").strip() or None,
-                sort_order=DBAccountMapping.get_next_sort_order(realm_id),
+            new_mappings.append(
+                {
+                    "realm_id": realm_id,
+                    "pattern": mapping_data["pattern"],
+                    "from_account_id": mapping_data["from_account_id"],
+                    "from_account_name": mapping_data.get("from_account_name"),
+                    "to_account_id": mapping_data["to_account_id"],
+                    "to_account_name": mapping_data.get("to_account_name"),
+                    "is_active": mapping_data.get("is_active", True),
+                    "is_regex": is_regex,
+                    "category": (mapping_data.get("category") or "").strip() or None,
+                    "sort_order": DBAccountMapping.get_next_sort_order(realm_id),
+                }
             )
-            db.session.add(mapping)
             imported += 1
 
+        # One executemany instead of a unit-of-work flush per mapping
+        DBAccountMapping.insert_mappings_bulk(new_mappings)
         db.session.commit()
 
         logger.info(
@@ -548,29 +630,42 @@ def import_mappings():
 def export_mappings():
     """Export all mappings for current company as JSON array"""
     try:
-        realm_id = get_current_realm_id()
-        query = DBAccountMapping.query.order_by(DBAccountMapping.sort_order.asc())
+        realm_id = current_realm_id()
+
+        # Plain rows, streamed in batches: the export is never held in
+        # memory as ORM objects or as one large list
+        stmt = (
+            select(
+                DBAccountMapping.pattern,
+                DBAccountMapping.from_account_id,
+                DBAccountMapping.from_account_name,
+                DBAccountMapping.to_account_id,
+                DBAccountMapping.to_account_name,
+                DBAccountMapping.is_active,
+                DBAccountMapping.is_regex,
+                DBAccountMapping.category,
+            )
+            .order_by(DBAccountMapping.sort_order.asc())
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
 
         if realm_id:
-            query = query.filter(DBAccountMapping.realm_id == realm_id)
+            stmt = stmt.where(DBAccountMapping.realm_id == realm_id)
 
-        mappings = query.all()
+        # Executed up front so query errors still produce a 500 response
+        result = db.session.execute(stmt)
+        dumps = current_app.json.dumps
 
-        export_data = [
-            {
-                "pattern": m.pattern,
-                "from_account_id": m.from_account_id,
-                "from_account_name": m.from_account_name,
-                "to_account_id": m.to_account_id,
-                "to_account_name": m.to_account_name,
-                "is_active": m.is_active,
-                "is_regex": m.is_regex,
-                "category": m.category,
-            }
-            for m in mappings
-        ]
+        def generate():
+            separator = "["
+            for rows in result.partitions():
+                yield separator + ",".join(dumps(row._asdict()) for row in rows)
+                separator = ","
+            yield "]\n" if separator == "," else "[]\n"
 
-        return jsonify(export_data)
+        return Response(
+            stream_with_context(generate()), mimetype=current_app.json.mimetype
+        )
 
     except Exception as e:
         logger.error(f"Error exporting mappings: {str(e)}")
@@ -582,7 +677,7 @@ def export_mappings():
 def check_duplicate():
     """Check if a mapping with the same pattern and from_account already exists for current company"""
     try:
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
         data = request.json
 
         if not data:
@@ -606,12 +701,17 @@ def check_duplicate():
         if exclude_id:
             query = query.filter(DBAccountMapping.id != exclude_id)
 
-        existing = query.first()
+        # Most checks find nothing: answer with EXISTS and only load the
+        # existing row when there is one to return
+        is_duplicate = db.session.query(
+            query.with_entities(DBAccountMapping.id).exists()
+        ).scalar()
+        existing = query.first() if is_duplicate else None
 
         return jsonify(
             {
                 "success": True,
-                "is_duplicate": existing is not None,
+                "is_duplicate": is_duplicate,
                 "existing_mapping": existing.to_dict() if existing else None,
             }
         )
@@ -629,34 +729,58 @@ def check_duplicate():
 @bp.route("/history", methods=["GET"])
 @require_qbo_auth
 def list_history():
-    """Get update history with optional filtering"""
-    from app.models.update_history import UpdateHistory
-
+    """
+    Get update history with optional filtering.
+    Pages by offset, or by the next_cursor returned with the previous page.
+    """
     try:
         # Get optional query parameters
-        limit = request.args.get("limit", 50, type=int)
-        offset = request.args.get("offset", 0, type=int)
+        limit = max(request.args.get("limit", 50, type=int), 1)
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        cursor = request.args.get("cursor")
         journal_id = request.args.get("journal_id")
 
-        # Build query
-        query = UpdateHistory.query.order_by(UpdateHistory.updated_at.desc())
+        # Build query; id breaks ties so the cursor position is exact
+        query = UpdateHistory.query.order_by(
+            UpdateHistory.updated_at.desc(), UpdateHistory.id.desc()
+        )
 
         if journal_id:
             query = query.filter_by(journal_id=journal_id)
 
-        # Get total count before pagination
-        total = query.count()
-
-        # Apply pagination
-        history = query.offset(offset).limit(limit).all()
+        if cursor:
+            # Keyset pagination: continue after the last row of the previous
+            # page without counting or skipping rows
+            try:
+                query = query.filter(UpdateHistory.after_cursor(cursor))
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+            total = None
+        else:
+            # Get total count before pagination. Counted directly rather than
+            # with query.count(), which wraps the ordered query in a subquery
+            # and sorts the whole table just to count it.
+            count_query = db.session.query(func.count(UpdateHistory.id))
+            if journal_id:
+                count_query = count_query.filter_by(journal_id=journal_id)
+            total = count_query.scalar()
+            query = query.offset(offset)
+
+        # Fetch one extra row to tell whether another page follows
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        history = [h.to_dict() for h in rows[:limit]]
+        last = history[-1] if has_more and history else None
 
         return jsonify(
             {
                 "success": True,
-                "history": [h.to_dict() for h in history],
+                "history": history,
                 "total": total,
                 "limit": limit,
                 "offset": offset,
+                "has_more": has_more,
+                "next_cursor": UpdateHistory.cursor_for(last) if last else None,
             }
         )
 
@@ -669,14 +793,8 @@ def list_history():
 @require_qbo_auth
 def history_stats():
     """Get update history statistics"""
-    from app.models.update_history import UpdateHistory
-    from sqlalchemy import func
-
     try:
-        # Get total updates
-        total_updates = UpdateHistory.query.count()
-
-        # Get updates by account
+        # Get updates by account; the total is the sum of the groups
         updates_by_account = (
             db.session.query(
                 UpdateHistory.to_account_name,
@@ -685,6 +803,7 @@ def history_stats():
             .group_by(UpdateHistory.to_account_name)
             .all()
         )
+        total_updates = sum(cnt for _, cnt in updates_by_account)
 
         return jsonify(
             {
@@ -711,8 +830,6 @@ def history_stats():
 @bp.route("/status", methods=["GET"])
 def system_status():
     """Get system status including encryption status"""
-    from app.models.qbo_connection import QBOConnection
-
     try:
         # Check QBO connection and encryption
         connection = QBOConnection.query.first()
@@ -724,8 +841,6 @@ def system_status():
             qbo_status["tokens_encrypted"] = connection.tokens_encrypted
 
         # Check if encryption key is configured (not auto-generated)
-        import os
-
         encryption_key_set = bool(os.getenv("ENCRYPTION_KEY"))
 
         return jsonify(
@@ -4,8 +4,12 @@
 Authentication routes (App password + QuickBooks OAuth)
 """
 
+import hmac
 import logging
-from datetime import timedelta
+import math
+import threading
+import time
+from collections import deque
 from flask import (
     Blueprint,
     redirect,
@@ -16,15 +20,74 @@ from flask import (
     current_app,
 )
 from app.extensions import db
+from app.models.qbo_connection import QBOConnection
 from app.services.qbo import qbo_service
 from app.services.token_service import token_service
+from app.utils.context import (
+    current_connection,
+    current_realm_id,
+    forget_current_company,
+)
 from app.utils.decorators import require_app_password, require_qbo_auth
-from intuitlib.enums import Scopes
-from intuitlib.exceptions import AuthClientError
 
 bp = Blueprint("auth", __name__)
 logger = logging.getLogger(__name__)
 
+# Failed password attempts allowed per client address:
+# (max attempts, window seconds). Counted per process, so with several
+# workers a client gets up to this many attempts in each of them. Clients
+# are told apart by request.remote_addr, so behind a proxy TRUSTED_PROXIES
+# must be set for it to hold the real address.
+LOGIN_RATE_LIMITS = ((5, 60), (30, 60 * 60))
+_LOGIN_WINDOW = max(window for _, window in LOGIN_RATE_LIMITS)
+
+# Client address -> timestamps of recent failed login attempts
+_login_attempts = {}
+_login_attempts_lock = threading.Lock()
+
+
+def _login_retry_after(client: str) -> int:
+    """
+    Seconds client must wait before trying another password, or 0 if it
+    may try now. Records nothing.
+    """
+    now = time.monotonic()
+    wait = 0.0
+    with _login_attempts_lock:
+        attempts = _login_attempts.get(client)
+        if attempts is None:
+            return 0
+        while attempts and now - attempts[0] >= _LOGIN_WINDOW:
+            attempts.popleft()
+        if not attempts:
+            del _login_attempts[client]
+            return 0
+        for limit, window in LOGIN_RATE_LIMITS:
+            recent = [t for t in attempts if now - t < window]
+            if len(recent) >= limit:
+                # Allowed again once enough of these have left the window
+                wait = max(wait, recent[len(recent) - limit] + window - now)
+    return math.ceil(wait)
+
+
+def _record_failed_login(client: str):
+    """Remember a failed login from client, forgetting clients gone quiet"""
+    now = time.monotonic()
+    with _login_attempts_lock:
+        for key in [
+            key
+            for key, attempts in _login_attempts.items()
+            if now - attempts[-1] >= _LOGIN_WINDOW
+        ]:
+            del _login_attempts[key]
+        _login_attempts.setdefault(client, deque()).append(now)
+
+
+def _clear_failed_logins(client: str):
+    """Forget client's failed logins after it signs in"""
+    with _login_attempts_lock:
+        _login_attempts.pop(client, None)
+
 
 # =============================================================================
 # App Password Authentication
@@ -47,20 +110,39 @@ def login():
     error = None
 
     if request.method == "POST":
-        password = request.form.get("password", "")
+        client = request.remote_addr or ""
+
+        # Throttled attempts are rejected before the password is checked
+        retry_after = _login_retry_after(client)
+        if retry_after:
+            logger.debug(f"Login rate limit reached for {client}")
+            if retry_after > 90:
+                wait = f"{math.ceil(retry_after / 60)} minutes"
+            else:
+                wait = f"{retry_after} seconds"
+            error = f"Too many attempts. Please try again in {wait}."
+            return (
+                render_template("login.html", error=error),
+                429,
+                {"Retry-After": str(retry_after)},
+            )
+
+        password = request.form.get("password", "").encode("utf-8")
         remember = request.form.get("remember") == "on"
+        expected = current_app.config.get("APP_PASSWORD_BYTES") or app_password.encode(
+            "utf-8"
+        )
 
-        if password == app_password:
+        if hmac.compare_digest(password, expected):
+            _clear_failed_logins(client)
             session["app_authenticated"] = True
+            # Remembered sessions last PERMANENT_SESSION_LIFETIME (30 days)
             session.permanent = remember
 
-            if remember:
-                # Set session to last 30 days
-                current_app.permanent_session_lifetime = timedelta(days=30)
-
             logger.info("App password authentication successful")
             return redirect(url_for("journal.list_journals"))
         else:
+            _record_failed_login(client)
             logger.warning("Failed app password attempt")
             error = "Invalid password. Please try again."
 
@@ -92,6 +174,8 @@ def logout():
 @bp.route("/auth")
 def qbo_auth():
     """Initiate QuickBooks OAuth flow"""
+    from intuitlib.enums import Scopes
+
     try:
         # Define required scopes for QuickBooks API access
         scopes = [Scopes.ACCOUNTING]
@@ -114,6 +198,9 @@ def qbo_auth():
 @bp.route("/callback")
 def callback():
     """Handle QuickBooks OAuth callback"""
+    from intuitlib.exceptions import AuthClientError
+    from quickbooks import QuickBooks
+
     try:
         # Check for error response from QuickBooks
         error = request.args.get("error")
@@ -140,27 +227,32 @@ def callback():
                 show_retry=True,
             )
 
-        logger.info(f"OAuth callback received for realm: {realm_id}")
+        logger.debug(f"OAuth callback received for realm: {realm_id}")
 
         # Exchange authorization code for tokens
         qbo_service.auth_client.get_bearer_token(auth_code, realm_id=realm_id)
         qbo_service.auth_client.realm_id = realm_id
-
-        # Try to fetch company name from QuickBooks
-        company_name = None
-        try:
-            qbo_service.authenticate()
-            from quickbooks.objects.company_info import CompanyInfo
-
-            company_info = CompanyInfo.get(realm_id, qb=qbo_service.qb)
-            if company_info:
-                company_name = company_info.CompanyName
-                logger.info(f"Retrieved company name: {company_name}")
-        except Exception as e:
-            logger.warning(f"Could not fetch company name: {str(e)}")
-
-        # Save tokens to database for persistence (with company name)
-        token_service.save_tokens(qbo_service.auth_client, company_name=company_name)
+        forget_current_company()
+
+        # Save tokens to database for persistence
+        token_service.save_tokens(qbo_service.auth_client)
+
+        # The company name is only for display, so fetch it from QuickBooks
+        # in the background instead of holding up the redirect. The thread
+        # gets its own client built from the fresh tokens, so it never
+        # refreshes or replaces the shared service's clients.
+        auth_client = qbo_service.auth_client
+        qb = QuickBooks(
+            auth_client=auth_client,
+            refresh_token=auth_client.refresh_token,
+            company_id=realm_id,
+            minorversion=65,
+        )
+        threading.Thread(
+            target=_fetch_company_name,
+            args=(current_app._get_current_object(), realm_id, qb),
+            daemon=True,
+        ).start()
 
         # Store realm_id in session for reference
         session["qbo_realm_id"] = realm_id
@@ -189,15 +281,31 @@ def callback():
         )
 
 
+def _fetch_company_name(app, realm_id, qb):
+    """Fetch and store the company name of a new connection (runs in a thread)"""
+    from quickbooks.objects.company_info import CompanyInfo
+
+    with app.app_context():
+        try:
+            company_info = CompanyInfo.get(realm_id, qb=qb)
+            if company_info and company_info.CompanyName:
+                connection = QBOConnection.query.filter_by(realm_id=realm_id).first()
+                if connection:
+                    connection.company_name = company_info.CompanyName
+                    db.session.commit()
+                    logger.info(f"Retrieved company name: {company_info.CompanyName}")
+        except Exception as e:
+            logger.warning(f"Could not fetch company name: {str(e)}")
+            db.session.rollback()
+
+
 @bp.route("/disconnect")
 @require_app_password
 def disconnect():
     """Disconnect QuickBooks (clear QBO tokens, keep app password session)"""
     try:
         # Get realm_id before clearing
-        realm_id = session.get("qbo_realm_id") or (
-            qbo_service.auth_client.realm_id if qbo_service.auth_client else None
-        )
+        realm_id = session.get("qbo_realm_id") or current_realm_id()
 
         # Clear QBO-related session data
         session.pop("qbo_realm_id", None)
@@ -206,11 +314,9 @@ def disconnect():
         if realm_id:
             token_service.delete_connection(realm_id)
 
-        # Reset QBO service tokens
-        if qbo_service.auth_client:
-            qbo_service.auth_client.access_token = None
-            qbo_service.auth_client.refresh_token = None
-            qbo_service.auth_client.realm_id = None
+        # Reset QBO service tokens and the client built from them
+        qbo_service.reset()
+        forget_current_company()
 
         logger.info("QuickBooks disconnected")
 
@@ -235,19 +341,12 @@ def list_companies():
     see and switch to other companies even if current connection has expired tokens.
     """
     try:
-        connections = token_service.get_all_connections()
-        current_realm = (
-            qbo_service.auth_client.realm_id if qbo_service.auth_client else None
-        )
-
-        companies = []
-        for conn in connections:
-            companies.append(
-                {
-                    **conn.to_dict(),
-                    "is_current": conn.realm_id == current_realm,
-                }
-            )
+        # Cached briefly; any write to a connection drops the cache
+        current_realm = current_realm_id()
+        companies = [
+            {**company, "is_current": company["realm_id"] == current_realm}
+            for company in QBOConnection.get_all_dicts()
+        ]
 
         return {"companies": companies, "current_realm_id": current_realm}
 
@@ -261,7 +360,7 @@ def list_companies():
 def get_current_company():
     """Get the currently active QBO company (requires valid QBO connection)"""
     try:
-        connection = token_service.get_connection()
+        connection = current_connection()
         if not connection:
             return {"company": None}
 
@@ -299,6 +398,7 @@ def switch_company():
 
         # Update session
         session["qbo_realm_id"] = realm_id
+        forget_current_company()
 
         # Reset the QBO client so it re-authenticates with new tokens
         qbo_service.qb = None
@@ -326,15 +426,15 @@ def refresh_company_name():
     Refresh the company name from QuickBooks for the current connection.
     Useful when company_name is missing or outdated.
     """
+    from quickbooks.objects.company_info import CompanyInfo
+
     try:
-        connection = token_service.get_connection()
+        connection = current_connection()
         if not connection:
             return {"error": "No active connection"}, 404
 
         # Fetch company name from QuickBooks
         qbo_service.authenticate()
-        from quickbooks.objects.company_info import CompanyInfo
-
         company_info = CompanyInfo.get(connection.realm_id, qb=qbo_service.qb)
         if company_info and company_info.CompanyName:
             connection.company_name = company_info.CompanyName
@@ -363,9 +463,7 @@ def delete_company(realm_id):
     delete companies with expired tokens. CSRF protected.
     """
     try:
-        current_realm = (
-            qbo_service.auth_client.realm_id if qbo_service.auth_client else None
-        )
+        current_realm = current_realm_id()
 
         # Don't allow deleting the current active company
         if realm_id == current_realm:
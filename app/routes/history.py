@@ -6,23 +6,15 @@ Routes for viewing update history
 
 import logging
 from flask import Blueprint, render_template, request, jsonify
+from app.utils.context import current_realm_id
 from app.utils.decorators import require_qbo_auth
 from app.models.update_history import UpdateHistory
-from app.services.qbo import qbo_service
 from app.extensions import db
-from sqlalchemy import func
 
 bp = Blueprint("history", __name__, url_prefix="/history")
 logger = logging.getLogger(__name__)
 
 
-def get_current_realm_id():
-    """Get the current realm_id from the QBO service"""
-    if qbo_service.auth_client and qbo_service.auth_client.realm_id:
-        return qbo_service.auth_client.realm_id
-    return None
-
-
 @bp.route("/")
 @require_qbo_auth
 def view_history():
@@ -36,7 +28,7 @@ def get_history_data():
     """Get history data with filtering and pagination"""
     try:
         # Get current realm_id for filtering
-        realm_id = get_current_realm_id()
+        realm_id = current_realm_id()
 
         # Get query parameters
         page = request.args.get("page", 1, type=int)
@@ -45,38 +37,72 @@ def get_history_data():
         from_date = request.args.get("from_date", "").strip()
         to_date = request.args.get("to_date", "").strip()
 
-        # Build query - filter by realm_id
-        query = UpdateHistory.query.order_by(UpdateHistory.updated_at.desc())
-
-        # Filter by realm_id (only show history for current company)
-        if realm_id:
-            query = query.filter(UpdateHistory.realm_id == realm_id)
+        cursor = request.args.get("cursor")
+
+        # Without a company there is no history to show (and other
+        # companies' history must not be)
+        if not realm_id:
+            return jsonify(
+                {
+                    "success": True,
+                    "history": [],
+                    "total": 0,
+                    "page": page,
+                    "per_page": per_page,
+                    "total_pages": 0,
+                    "has_more": False,
+                    "next_cursor": None,
+                }
+            )
+
+        # Build query for the current company only; id breaks ties so the
+        # cursor position is exact. Plain column rows: the listing is only
+        # serialized, so ORM instances would be built for nothing.
+        query = (
+            UpdateHistory.select_dict_fields()
+            .where(UpdateHistory.realm_id == realm_id)
+            .order_by(UpdateHistory.updated_at.desc(), UpdateHistory.id.desc())
+        )
 
         # Apply filters
         if journal_id:
-            query = query.filter(UpdateHistory.journal_id == journal_id)
+            query = query.where(UpdateHistory.journal_id == journal_id)
 
         if from_date:
-            query = query.filter(UpdateHistory.journal_date >= from_date)
+            query = query.where(UpdateHistory.journal_date >= from_date)
 
         if to_date:
-            query = query.filter(UpdateHistory.journal_date <= to_date)
-
-        # Get total count
-        total = query.count()
-
-        # Apply pagination
-        offset = (page - 1) * per_page
-        history = query.offset(offset).limit(per_page).all()
+            query = query.where(UpdateHistory.journal_date <= to_date)
+
+        # Get total count (cached briefly, so paging doesn't recount)
+        total = UpdateHistory.count_filtered(realm_id, journal_id, from_date, to_date)
+
+        if cursor:
+            # Keyset pagination: seek past the last row of the previous page
+            # instead of skipping (page - 1) * per_page rows
+            try:
+                query = query.where(UpdateHistory.after_cursor(cursor))
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+        else:
+            query = query.offset((page - 1) * per_page)
+
+        # Fetch one extra row to tell whether another page follows
+        rows = db.session.execute(query.limit(per_page + 1)).all()
+        has_more = len(rows) > per_page
+        history = [UpdateHistory.row_to_dict(row) for row in rows[:per_page]]
+        last = history[-1] if has_more and history else None
 
         return jsonify(
             {
                 "success": True,
-                "history": [h.to_dict() for h in history],
+                "history": history,
                 "total": total,
                 "page": page,
                 "per_page": per_page,
                 "total_pages": (total + per_page - 1) // per_page,
+                "has_more": has_more,
+                "next_cursor": UpdateHistory.cursor_for(last) if last else None,
             }
         )
 
@@ -85,75 +111,42 @@ def get_history_data():
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route("/has-any")
+@require_qbo_auth
+def has_any_history():
+    """Whether the current company has any history, for the empty state"""
+    try:
+        realm_id = current_realm_id()
+        has_any = bool(realm_id) and UpdateHistory.has_history(realm_id)
+        return jsonify({"success": True, "has_any": has_any})
+
+    except Exception as e:
+        logger.error(f"Error checking for history: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
 @bp.route("/stats")
 @require_qbo_auth
 def get_stats():
     """Get history statistics for dashboard"""
     try:
         # Get current realm_id for filtering
-        realm_id = get_current_realm_id()
-
-        # Base query filtered by realm_id
-        base_query = UpdateHistory.query
-        if realm_id:
-            base_query = base_query.filter(UpdateHistory.realm_id == realm_id)
-
-        # Total updates
-        total_updates = base_query.count()
-
-        # Updates this month
-        from datetime import datetime, timedelta
-
-        month_start = datetime.now().replace(
-            day=1, hour=0, minute=0, second=0, microsecond=0
-        )
-        updates_this_month = base_query.filter(
-            UpdateHistory.updated_at >= month_start
-        ).count()
-
-        # Updates by destination account (top 5) - filtered by realm_id
-        account_query = db.session.query(
-            UpdateHistory.to_account_name,
-            func.count(UpdateHistory.id).label("count"),
-        )
-        if realm_id:
-            account_query = account_query.filter(UpdateHistory.realm_id == realm_id)
-        updates_by_account = (
-            account_query.group_by(UpdateHistory.to_account_name)
-            .order_by(func.count(UpdateHistory.id).desc())
-            .limit(5)
-            .all()
-        )
-
-        # Recent activity (last 7 days by day) - filtered by realm_id
-        week_ago = datetime.now() - timedelta(days=7)
-        daily_query = db.session.query(
-            func.date(UpdateHistory.updated_at).label("date"),
-            func.count(UpdateHistory.id).label("count"),
-        ).filter(UpdateHistory.updated_at >= week_ago)
-        if realm_id:
-            daily_query = daily_query.filter(UpdateHistory.realm_id == realm_id)
-        daily_updates = (
-            daily_query.group_by(func.date(UpdateHistory.updated_at))
-            .order_by(func.date(UpdateHistory.updated_at))
-            .all()
-        )
-
-        return jsonify(
-            {
-                "success": True,
-                "total_updates": total_updates,
-                "updates_this_month": updates_this_month,
-                "top_accounts": [
-                    {"account": acc, "count": cnt}
-                    for acc, cnt in updates_by_account
-                    if acc
-                ],
-                "daily_updates": [
-                    {"date": str(d), "count": c} for d, c in daily_updates
-                ],
-            }
-        )
+        realm_id = current_realm_id()
+        if not realm_id:
+            return jsonify(
+                {
+                    "success": True,
+                    "total_updates": 0,
+                    "updates_this_month": 0,
+                    "top_accounts": [],
+                    "daily_updates": [],
+                }
+            )
+
+        # Cached briefly per realm; logging new updates drops the cache
+        stats = UpdateHistory.get_stats(realm_id)
+
+        return jsonify({"success": True, **stats})
 
     except Exception as e:
         logger.error(f"Error getting history stats: {str(e)}")
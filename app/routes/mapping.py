@@ -6,9 +6,11 @@ Account mapping configuration routes
 
 import logging
 from flask import Blueprint, render_template, request, jsonify
+from sqlalchemy.exc import IntegrityError
 from app.services.qbo import qbo_service
 from app.extensions import db
 from app.models.db_account_mapping import DBAccountMapping
+from app.utils.context import current_realm_id
 from app.utils.decorators import require_qbo_auth
 
 bp = Blueprint("mapping", __name__)
@@ -21,17 +23,14 @@ def mapping_config():
     """Display mapping configuration page"""
     try:
         # Get current realm_id
-        realm_id = qbo_service.get_current_realm_id()
+        realm_id = current_realm_id()
 
         # Get accounts for dropdowns
         accounts = qbo_service.get_accounts()
 
-        # Get current mappings from database ordered by sort_order (filtered by realm)
-        query = DBAccountMapping.query.order_by(DBAccountMapping.sort_order.asc())
-        if realm_id:
-            query = query.filter(DBAccountMapping.realm_id == realm_id)
-        db_mappings = query.all()
-        mappings = [m.to_dict() for m in db_mappings]
+        # Get current mappings ordered by sort_order (filtered by realm), as
+        # dicts built straight from column rows
+        mappings = DBAccountMapping.get_mapping_dicts(realm_id=realm_id)
 
         logger.debug(
             f"Loaded {len(accounts)} accounts and {len(mappings)} mappings for realm {realm_id}"
@@ -53,7 +52,7 @@ def mapping_config():
 def save_mapping():
     """Save mapping configuration to database for current company"""
     try:
-        realm_id = qbo_service.get_current_realm_id()
+        realm_id = current_realm_id()
         mapping_data = request.json
 
         if not mapping_data:
@@ -65,24 +64,9 @@ def save_mapping():
             if field not in mapping_data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
 
-        # Check for duplicate within current realm
-        query = DBAccountMapping.query.filter_by(
-            pattern=mapping_data["pattern"],
-            from_account_id=mapping_data["from_account_id"],
-            is_active=True,
-        )
-        if realm_id:
-            query = query.filter(DBAccountMapping.realm_id == realm_id)
-        existing = query.first()
-
-        if existing:
-            return jsonify(
-                {
-                    "error": "A mapping with this pattern and source account already exists"
-                }
-            ), 409
-
-        # Create new mapping with next sort_order for this realm
+        # Create new mapping with next sort_order for this realm. Duplicate
+        # active mappings within the realm are rejected by the
+        # uq_mappings_active_pattern index on commit.
         mapping = DBAccountMapping(
             realm_id=realm_id,
             pattern=mapping_data["pattern"],
@@ -101,6 +85,12 @@ def save_mapping():
 
         return jsonify({"success": True, "mapping": mapping.to_dict()}), 201
 
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(
+            {"error": "A mapping with this pattern and source account already exists"}
+        ), 409
+
     except Exception as e:
         logger.error(f"Error saving mapping: {str(e)}")
         db.session.rollback()
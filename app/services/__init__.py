@@ -4,7 +4,8 @@
 Service layer for JournalSmart
 """
 
+from app.services.mapping_matcher import MappingMatcher
 from app.services.qbo import qbo_service, init_qbo
 from app.services.token_service import token_service
 
-__all__ = ["qbo_service", "init_qbo", "token_service"]
+__all__ = ["MappingMatcher", "qbo_service", "init_qbo", "token_service"]
@@ -0,0 +1,140 @@
+# File: app/services/mapping_matcher.py
+"""
+/app/services/mapping_matcher.py
+Batch matcher for applying account mappings to journal lines
+"""
+
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from app.models.account_mapping import AccountMapping
+
+logger = logging.getLogger(__name__)
+
+# Below this many plain-text patterns per account, testing each with `in` is
+# faster than walking the automaton in Python
+AUTOMATON_MIN_PATTERNS = 24
+
+
+class LiteralAutomaton:
+    """
+    Aho-Corasick automaton over lowercased plain-text patterns.
+
+    Each pattern carries a rank (its position in sort order). scan() walks the
+    text once and returns the best (lowest) rank of any pattern occurring in
+    it, regardless of how many patterns there are.
+    """
+
+    NO_MATCH = float("inf")
+
+    def __init__(self, patterns: List[Tuple[str, int]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[float] = [self.NO_MATCH]
+        self.best_possible = min(rank for _, rank in patterns)
+
+        for pattern, rank in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(self.NO_MATCH)
+                state = next_state
+            self._best[state] = min(self._best[state], rank)
+
+        # Breadth-first so each fail target is complete before it's inherited
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._best[next_state] = min(
+                    self._best[next_state], self._best[self._fail[next_state]]
+                )
+                queue.append(next_state)
+
+    def scan(self, text: str) -> float:
+        """Return the best rank of any pattern found in text, or NO_MATCH"""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        best = best_at[0]  # an empty pattern matches everything
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best_at[state] < best:
+                best = best_at[state]
+                if best == self.best_possible:
+                    break
+        return best
+
+
+class MappingMatcher:
+    """
+    Matches journal line descriptions against an ordered set of mappings.
+
+    Mappings are indexed by source account once, so each line is only tested
+    against the rules that can apply to it. The first matching mapping (in the
+    order given, i.e. sort_order) wins.
+
+    Accounts with many plain-text patterns get a LiteralAutomaton, so the
+    best plain-text match is found in a single pass over the description.
+    Regex mappings are then only tried if they rank ahead of it.
+    """
+
+    def __init__(self, mappings: List[AccountMapping]):
+        self.mappings = list(mappings)
+        self._by_account: Dict[str, List[AccountMapping]] = {}
+        for mapping in self.mappings:
+            self._by_account.setdefault(mapping.from_account_id, []).append(mapping)
+
+        self._literals: Dict[str, LiteralAutomaton] = {}
+        # account_id -> [(rank, mapping)] for regex mappings
+        self._regexes: Dict[str, List[Tuple[int, AccountMapping]]] = {}
+        for account_id, candidates in self._by_account.items():
+            patterns = [
+                (m._lower, i) for i, m in enumerate(candidates) if not m.is_regex
+            ]
+            if len(patterns) >= AUTOMATON_MIN_PATTERNS:
+                self._literals[account_id] = LiteralAutomaton(patterns)
+            self._regexes[account_id] = [
+                (i, m) for i, m in enumerate(candidates) if m.is_regex
+            ]
+
+    def __len__(self):
+        return len(self.mappings)
+
+    def match(self, account_id: str, description: str) -> Optional[AccountMapping]:
+        """Return the first mapping for account_id that matches description"""
+        candidates = self._by_account.get(account_id)
+        if not candidates or not description:
+            return None
+
+        # Lowercased once per line rather than once per mapping. Literals are
+        # scanned against it so they agree exactly with the substring test.
+        description_lower = description.lower()
+
+        automaton = self._literals.get(account_id)
+        if automaton is None:
+            for mapping in candidates:
+                if mapping.matches_lowered(description, description_lower):
+                    return mapping
+            return None
+
+        best = automaton.scan(description_lower)
+
+        for rank, mapping in self._regexes[account_id]:
+            if rank > best:
+                break
+            if mapping.matches_lowered(description, description_lower):
+                return mapping
+
+        return candidates[best] if best < len(candidates) else None
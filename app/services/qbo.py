@@ -10,16 +10,20 @@ import traceback
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
-from quickbooks import QuickBooks
-from quickbooks.objects.journalentry import JournalEntry
-from quickbooks.objects.account import Account
-from intuitlib.client import AuthClient
-
+# The QuickBooks SDK and intuitlib (and requests under them) are imported
+# where they are used, so creating the app does not load them
 from app.models.account_mapping import AccountMapping
+from app.services.mapping_matcher import MappingMatcher
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Ids per "Id IN (...)" query; matches QuickBooks' default page size
+ID_BATCH_SIZE = 100
+
+# Most pattern test results kept at once (one per account/date range)
+PATTERN_TEST_CACHE_MAXSIZE = 64
+
 
 class QBOService:
     def __init__(self, app=None):
@@ -30,12 +34,19 @@ class QBOService:
         self._account_cache: Dict[str, Any] = {}
         self._cache_timeout = 3600  # 1 hour in seconds
         self._last_cache_update: Dict[str, datetime] = {}
+        # Pattern test journal cache (short-lived; cleared on journal updates)
+        self._pattern_test_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._pattern_test_cache_timeout = 600  # 10 minutes in seconds
+        # Fallback mappings from .env, built on first use (the env is fixed)
+        self._env_mappings: Optional[List[AccountMapping]] = None
 
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
         """Initialize the QBO service with Flask app config"""
+        from intuitlib.client import AuthClient
+
         self.auth_client = AuthClient(
             client_id=app.config["QBO_CLIENT_ID"],
             client_secret=app.config["QBO_CLIENT_SECRET"],
@@ -63,6 +74,8 @@ class QBOService:
 
     def authenticate(self):
         """Initialize QuickBooks client with OAuth tokens"""
+        from quickbooks import QuickBooks
+
         if not self.auth_client.access_token:
             raise Exception("No access token available. Please authenticate first.")
 
@@ -79,6 +92,24 @@ class QBOService:
         )
         logger.debug("QuickBooks client authenticated")
 
+    def reset(self):
+        """
+        Forget the connected company: clear the auth client's tokens, drop the
+        QuickBooks client built from them and empty the caches.
+        The AuthClient itself is kept, since building one refetches Intuit's
+        discovery document.
+        """
+        if self.auth_client:
+            self.auth_client.access_token = None
+            self.auth_client.refresh_token = None
+            self.auth_client.id_token = None
+            self.auth_client.expires_in = None
+            self.auth_client.realm_id = None
+        self.qb = None
+        self._account_cache.clear()
+        self._pattern_test_cache.clear()
+        self._last_cache_update.clear()
+
     # =========================================================================
     # Helper Methods
     # =========================================================================
@@ -101,14 +132,61 @@ class QBOService:
             "balance": getattr(account, "CurrentBalance", 0),
         }
 
-    def _is_cache_valid(self, key: str) -> bool:
+    def _is_cache_valid(self, key: str, timeout: Optional[int] = None) -> bool:
         """Check if cache entry is still valid"""
         if key not in self._last_cache_update:
             return False
 
         now = datetime.now()
         time_diff = (now - self._last_cache_update[key]).total_seconds()
-        return time_diff < self._cache_timeout
+        return time_diff < (timeout or self._cache_timeout)
+
+    def clear_pattern_test_cache(self):
+        """Drop cached pattern test journals (after journals were changed)"""
+        for key in self._pattern_test_cache:
+            self._last_cache_update.pop(key, None)
+        self._pattern_test_cache.clear()
+
+    def _store_pattern_test(self, key: str, result: List[Dict[str, Any]]):
+        """Cache a pattern test result, dropping expired and oldest entries"""
+        for stale in [
+            k
+            for k in self._pattern_test_cache
+            if not self._is_cache_valid(k, self._pattern_test_cache_timeout)
+        ]:
+            self._pattern_test_cache.pop(stale, None)
+            self._last_cache_update.pop(stale, None)
+
+        while len(self._pattern_test_cache) >= PATTERN_TEST_CACHE_MAXSIZE:
+            oldest = min(
+                self._pattern_test_cache,
+                key=lambda k: self._last_cache_update.get(k, datetime.min),
+            )
+            self._pattern_test_cache.pop(oldest, None)
+            self._last_cache_update.pop(oldest, None)
+
+        self._pattern_test_cache[key] = result
+        self._last_cache_update[key] = datetime.now()
+
+    def clear_account_list_cache(self):
+        """Drop cached account lists (their balances change with journals)"""
+        for key in [k for k in self._account_cache if k.startswith("accounts_list_")]:
+            self._account_cache.pop(key, None)
+            self._last_cache_update.pop(key, None)
+
+    def _fetch_by_ids(self, entity, ids: List[str]) -> Dict[str, Any]:
+        """
+        Fetch QuickBooks objects by sanitized id with one query per
+        ID_BATCH_SIZE ids. Returns {id: object}; ids not found are absent.
+        """
+        found = {}
+        for start in range(0, len(ids), ID_BATCH_SIZE):
+            batch = ids[start : start + ID_BATCH_SIZE]
+            # Sanitized ids are digits only, so they're safe to inline
+            id_list = ", ".join(f"'{safe_id}'" for safe_id in batch)
+            for obj in entity.where(f"Id IN ({id_list})", qb=self.qb):
+                found[obj.Id] = obj
+        return found
 
     def _sanitize_id(self, value: str) -> Optional[str]:
         """
@@ -133,7 +211,14 @@ class QBOService:
     # =========================================================================
 
     def get_accounts(self) -> List[Dict[str, Any]]:
-        """Fetch all active accounts"""
+        """Fetch all active accounts, cached per company"""
+        from quickbooks.objects.account import Account
+
+        cache_key = f"accounts_list_{self.get_current_realm_id()}"
+        if cache_key in self._account_cache and self._is_cache_valid(cache_key):
+            logger.debug("Cache hit for account list")
+            return list(self._account_cache[cache_key])
+
         if not self.qb:
             self.authenticate()
 
@@ -141,7 +226,17 @@ class QBOService:
             accounts = Account.where("Active = true", qb=self.qb)
             logger.debug(f"Fetched {len(accounts)} accounts from QuickBooks")
 
-            return [self._format_account(account) for account in accounts]
+            formatted = [self._format_account(account) for account in accounts]
+
+            # The list also primes get_account_by_id() for every account
+            now = datetime.now()
+            for account in formatted:
+                self._account_cache[f"account_{account['id']}"] = account
+                self._last_cache_update[f"account_{account['id']}"] = now
+            self._account_cache[cache_key] = formatted
+            self._last_cache_update[cache_key] = now
+
+            return list(formatted)
 
         except Exception as e:
             error_str = str(e)
@@ -157,6 +252,8 @@ class QBOService:
 
     def get_account_by_id(self, account_id: str) -> Optional[Dict[str, Any]]:
         """Fetch account by ID with caching"""
+        from quickbooks.objects.account import Account
+
         # Sanitize the account_id
         safe_id = self._sanitize_id(account_id)
         if not safe_id:
@@ -192,6 +289,45 @@ class QBOService:
             logger.error(f"Error fetching account {safe_id}: {str(e)}")
             return None
 
+    def prefetch_accounts(self, account_ids) -> None:
+        """
+        Load every uncached account in account_ids into the account cache
+        with one QuickBooks query per ID_BATCH_SIZE ids. Accounts the query
+        doesn't return are left to get_account_by_id().
+        """
+        from quickbooks.objects.account import Account
+
+        missing = []
+        for account_id in set(account_ids):
+            safe_id = self._sanitize_id(account_id)
+            if not safe_id:
+                continue
+            cache_key = f"account_{safe_id}"
+            if cache_key not in self._account_cache or not self._is_cache_valid(
+                cache_key
+            ):
+                missing.append(safe_id)
+
+        if not missing:
+            return
+
+        if not self.qb:
+            self.authenticate()
+
+        try:
+            accounts = self._fetch_by_ids(Account, missing)
+
+            now = datetime.now()
+            for account_id, account in accounts.items():
+                cache_key = f"account_{account_id}"
+                self._account_cache[cache_key] = self._format_account(account)
+                self._last_cache_update[cache_key] = now
+
+            logger.debug(f"Prefetched {len(missing)} accounts from QuickBooks")
+
+        except Exception as e:
+            logger.warning(f"Error prefetching accounts: {str(e)}")
+
     # =========================================================================
     # Journal Methods
     # =========================================================================
@@ -219,35 +355,32 @@ class QBOService:
                 logger.debug(
                     f"Loaded {len(db_mappings)} mappings from database for realm {realm_id}"
                 )
-                return [
-                    AccountMapping(
-                        pattern=m.pattern,
-                        from_account_id=m.from_account_id,
-                        to_account_id=m.to_account_id,
-                        is_regex=m.is_regex,
-                    )
-                    for m in db_mappings
-                ]
+                return db_mappings
         except Exception as e:
             logger.warning(f"Could not load mappings from database: {str(e)}")
 
         # Fall back to .env configuration
-        raw_mappings = Config.get_account_mappings()
-        logger.debug(f"Loaded {len(raw_mappings)} mappings from .env")
-
-        return [
-            AccountMapping(
-                pattern=mapping["pattern"],
-                from_account_id=mapping["from_account_id"],
-                to_account_id=mapping["to_account_id"],
-            )
-            for mapping in raw_mappings
-        ]
+        if self._env_mappings is None:
+            raw_mappings = Config.get_account_mappings()
+            logger.debug(f"Loaded {len(raw_mappings)} mappings from .env")
+
+            self._env_mappings = [
+                AccountMapping(
+                    pattern=mapping["pattern"],
+                    from_account_id=mapping["from_account_id"],
+                    to_account_id=mapping["to_account_id"],
+                )
+                for mapping in raw_mappings
+            ]
+
+        return list(self._env_mappings)
 
     def get_journals_by_account(
         self, account_id: str, start_date: str
     ) -> List[Dict[str, Any]]:
         """Fetch journal entries filtered by account"""
+        from quickbooks.objects.journalentry import JournalEntry
+
         # Sanitize account_id
         safe_account_id = self._sanitize_id(account_id)
         if not safe_account_id:
@@ -265,8 +398,10 @@ class QBOService:
             logger.debug(f"Query executed: {query}")
             logger.debug(f"Total journals found before filtering: {len(journals)}")
 
-            # Get account mappings
-            account_mappings = self.get_account_mappings()
+            # Get account mappings, and load their target accounts up front
+            # so formatting doesn't fetch them one request at a time
+            matcher = MappingMatcher(self.get_account_mappings())
+            self.prefetch_accounts(m.to_account_id for m in matcher.mappings)
 
             # Filter journals that have lines with the selected account
             filtered_journals = []
@@ -290,12 +425,12 @@ class QBOService:
             for journal in filtered_journals:
                 formatted_journal = self._format_journal(
                     journal=journal,
-                    account_mappings=account_mappings,
+                    matcher=matcher,
                 )
                 if formatted_journal:
                     formatted_journals.append(formatted_journal)
 
-            logger.info(f"Journals with changes: {len(formatted_journals)}")
+            logger.debug(f"Journals with changes: {len(formatted_journals)}")
             return formatted_journals
 
         except Exception as e:
@@ -304,7 +439,7 @@ class QBOService:
             return []
 
     def _format_journal(
-        self, journal, account_mappings: List[AccountMapping]
+        self, journal, matcher: MappingMatcher
     ) -> Optional[Dict[str, Any]]:
         """
         Format journal entry for API response.
@@ -333,13 +468,10 @@ class QBOService:
 
                 # Look for matching pattern for ANY line (not just selected account)
                 proposed_account = None
-                for mapping in account_mappings:
-                    if mapping.from_account_id == account_ref.value and mapping.matches(
-                        description
-                    ):
-                        proposed_account = mapping.to_account_id
-                        formatted_journal["has_changes"] = True
-                        break
+                mapping = matcher.match(account_ref.value, description)
+                if mapping:
+                    proposed_account = mapping.to_account_id
+                    formatted_journal["has_changes"] = True
 
                 # Add the line if we found a matching pattern
                 if proposed_account:
@@ -373,12 +505,26 @@ class QBOService:
         """
         Fetch journal entries for pattern testing.
         Returns all lines for the specified account without mapping filtering.
+        Results are cached briefly so iterating on a pattern doesn't refetch
+        the same journals from QuickBooks on every test.
         """
+        from quickbooks.objects.journalentry import JournalEntry
+
         safe_account_id = self._sanitize_id(account_id)
         if not safe_account_id:
             logger.error(f"Invalid account_id for pattern test: {account_id}")
             return []
 
+        # Check cache first
+        cache_key = (
+            f"pattern_test_{self.get_current_realm_id()}_{safe_account_id}_{start_date}"
+        )
+        if cache_key in self._pattern_test_cache and self._is_cache_valid(
+            cache_key, self._pattern_test_cache_timeout
+        ):
+            logger.debug(f"Cache hit for pattern test journals {safe_account_id}")
+            return self._pattern_test_cache[cache_key]
+
         if not self.qb:
             self.authenticate()
 
@@ -402,9 +548,13 @@ class QBOService:
                         and line.JournalEntryLineDetail.AccountRef.value
                         == safe_account_id
                     ):
+                        description = line.Description or ""
                         journal_lines.append(
                             {
-                                "description": line.Description or "",
+                                "description": description,
+                                # Lowercased once here rather than on every
+                                # (cached) pattern test
+                                "description_lower": description.lower(),
                                 "amount": float(line.Amount)
                                 if hasattr(line, "Amount")
                                 else 0.0,
@@ -424,6 +574,7 @@ class QBOService:
             logger.debug(
                 f"Pattern test: {len(result)} journals have lines with account {safe_account_id}"
             )
+            self._store_pattern_test(cache_key, result)
             return result
 
         except Exception as e:
@@ -432,28 +583,45 @@ class QBOService:
 
     def update_journals_accounts(self, journal_ids: List[str]) -> List[Dict[str, Any]]:
         """Update journal accounts based on mappings"""
+        from quickbooks.objects.account import Account
+        from quickbooks.objects.journalentry import JournalEntry
         from app.extensions import db
         from app.models.update_history import UpdateHistory
-        from datetime import datetime
 
         if not self.qb:
             self.authenticate()
 
         results = []
-        account_mappings = self.get_account_mappings()
+        history_entries = []
+        matcher = MappingMatcher(self.get_account_mappings())
 
         logger.info(f"Starting update for {len(journal_ids)} journals")
 
+        # Sanitize each journal ID
+        safe_ids = []
         for journal_id in journal_ids:
-            # Sanitize each journal ID
             safe_id = self._sanitize_id(journal_id)
             if not safe_id:
                 logger.warning(f"Skipping invalid journal ID: {journal_id}")
                 continue
+            safe_ids.append(safe_id)
+
+        # Fetch the journals, and every account a mapping can move lines to,
+        # in batched queries rather than one request each
+        try:
+            journals = self._fetch_by_ids(JournalEntry, safe_ids)
+            target_ids = {self._sanitize_id(m.to_account_id) for m in matcher.mappings}
+            target_accounts = self._fetch_by_ids(
+                Account, [account_id for account_id in target_ids if account_id]
+            )
+        except Exception as e:
+            logger.error(f"Error fetching journals for update: {str(e)}")
+            logger.debug(traceback.format_exc())
+            return results
 
+        for safe_id in safe_ids:
             try:
-                # Fetch the journal
-                journal = JournalEntry.get(safe_id, qb=self.qb)
+                journal = journals.get(safe_id)
                 if not journal:
                     logger.warning(f"Journal not found: {safe_id}")
                     continue
@@ -469,83 +637,80 @@ class QBOService:
                     amount = float(line.Amount) if hasattr(line, "Amount") else None
 
                     # Check if this line matches any mapping
-                    for mapping in account_mappings:
-                        if (
-                            mapping.from_account_id == account_ref.value
-                            and mapping.matches(description)
-                        ):
-                            # Update the account reference
-                            old_account = {
-                                "id": account_ref.value,
-                                "name": account_ref.name,
-                            }
+                    mapping = matcher.match(account_ref.value, description)
+                    if not mapping:
+                        continue
+
+                    # Update the account reference
+                    old_account = {
+                        "id": account_ref.value,
+                        "name": account_ref.name,
+                    }
 
-                            # Get new account details
-                            new_account = Account.get(mapping.to_account_id, qb=self.qb)
+                    # Get new account details (fetched individually only if
+                    # the batch didn't return it)
+                    new_account = target_accounts.get(mapping.to_account_id)
+                    if not new_account:
+                        new_account = Account.get(mapping.to_account_id, qb=self.qb)
+                        target_accounts[mapping.to_account_id] = new_account
 
-                            if not new_account:
-                                logger.warning(
-                                    f"Target account not found: {mapping.to_account_id}"
-                                )
-                                break
+                    if not new_account:
+                        logger.warning(
+                            f"Target account not found: {mapping.to_account_id}"
+                        )
+                        continue
 
-                            new_account_dict = {
-                                "id": new_account.Id,
-                                "name": new_account.Name,
-                            }
+                    new_account_dict = {
+                        "id": new_account.Id,
+                        "name": new_account.Name,
+                    }
 
-                            # Update the line's account reference
-                            line.JournalEntryLineDetail.AccountRef.value = (
-                                new_account.Id
-                            )
-                            line.JournalEntryLineDetail.AccountRef.name = (
-                                new_account.Name
-                            )
+                    # Update the line's account reference
+                    line.JournalEntryLineDetail.AccountRef.value = new_account.Id
+                    line.JournalEntryLineDetail.AccountRef.name = new_account.Name
 
-                            journal_updated = True
+                    journal_updated = True
 
-                            # Log to history
+                    # Log to history
+                    try:
+                        # Parse journal date
+                        parsed_date = None
+                        if journal_date:
                             try:
-                                # Parse journal date
+                                parsed_date = datetime.strptime(
+                                    journal_date, "%Y-%m-%d"
+                                ).date()
+                            except (ValueError, TypeError):
                                 parsed_date = None
-                                if journal_date:
-                                    try:
-                                        parsed_date = datetime.strptime(
-                                            journal_date, "%Y-%m-%d"
-                                        ).date()
-                                    except (ValueError, TypeError):
-                                        parsed_date = None
-
-                                UpdateHistory.log_update(
-                                    journal_id=safe_id,
-                                    journal_date=parsed_date,
-                                    line_description=description,
-                                    from_account=old_account,
-                                    to_account=new_account_dict,
-                                    amount=amount,
-                                    realm_id=self.auth_client.realm_id
-                                    if self.auth_client
-                                    else None,
-                                )
-                            except Exception as hist_error:
-                                logger.warning(
-                                    f"Failed to log history: {str(hist_error)}"
-                                )
-
-                            results.append(
-                                {
-                                    "journal_id": safe_id,
-                                    "line_description": description,
-                                    "old_account": old_account,
-                                    "new_account": new_account_dict,
-                                }
-                            )
-                            break
+
+                        entry = UpdateHistory.entry_values(
+                            journal_id=safe_id,
+                            journal_date=parsed_date,
+                            line_description=description,
+                            from_account=old_account,
+                            to_account=new_account_dict,
+                            amount=amount,
+                            realm_id=self.auth_client.realm_id
+                            if self.auth_client
+                            else None,
+                        )
+                        history_entries.append(entry)
+                    except Exception as hist_error:
+                        logger.warning(f"Failed to log history: {str(hist_error)}")
+
+                    results.append(
+                        {
+                            "journal_id": safe_id,
+                            "line_description": description,
+                            "old_account": old_account,
+                            "new_account": new_account_dict,
+                        }
+                    )
 
                 # Only save if we made changes
                 if journal_updated:
                     journal.save(qb=self.qb)
-                    logger.info(f"Journal {safe_id} saved successfully")
+                    logger.debug(f"Journal {safe_id} saved successfully")
 
             except Exception as e:
                 logger.error(f"Error updating journal {safe_id}: {str(e)}")
@@ -553,10 +718,17 @@ class QBOService:
                 # Continue with other journals instead of failing completely
                 continue
 
-        # Commit all history entries
+        # Updated lines may have moved off the accounts being tested, and
+        # the cached account list carries balances that have now changed
+        if results:
+            self.clear_pattern_test_cache()
+            self.clear_account_list_cache()
+
+        # Insert and commit all history entries at once
         try:
+            logged = UpdateHistory.log_updates_bulk(history_entries)
             db.session.commit()
-            logger.debug(f"Committed {len(results)} history entries")
+            logger.debug(f"Committed {logged} history entries")
         except Exception as e:
             logger.error(f"Failed to commit history: {str(e)}")
             db.session.rollback()
@@ -5,6 +5,8 @@ Token persistence and management service
 """
 
 import logging
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from app.extensions import db
@@ -13,6 +15,11 @@ from app.utils.encryption import encrypt_token, is_encrypted
 
 logger = logging.getLogger(__name__)
 
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_BUFFER = 5 * 60
+
+_refresh_lock = threading.Lock()
+
 
 class TokenService:
     """Service for managing QBO OAuth tokens in the database"""
@@ -120,72 +127,68 @@ class TokenService:
         Returns:
             True if tokens are valid (refreshed or still valid), False on error
         """
-        try:
-            if not auth_client.refresh_token:
-                logger.warning("No refresh token available")
-                return False
-
-            # Get the connection to check expiration
-            connection = QBOConnection.query.filter_by(
-                realm_id=auth_client.realm_id
-            ).first()
-
-            if not connection:
-                logger.warning("No connection found for refresh check")
-                return False
-
-            # Check if token is expired or will expire in next 5 minutes
-            buffer = timedelta(minutes=5)
-            now = datetime.now(timezone.utc)
-
-            # Handle naive datetime from database
-            expires_at = connection.token_expires_at
-            if expires_at and expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-
-            if expires_at and now < (expires_at - buffer):
-                logger.debug("Tokens still valid, no refresh needed")
+        # Serialized so the background refresher and a request in this
+        # process never spend the same refresh token twice; other worker
+        # processes are not covered by this lock
+        with _refresh_lock:
+            try:
+                if not auth_client.refresh_token:
+                    logger.warning("No refresh token available")
+                    return False
+
+                # Get the connection to check expiration
+                connection = QBOConnection.query.filter_by(
+                    realm_id=auth_client.realm_id
+                ).first()
+
+                if not connection:
+                    logger.warning("No connection found for refresh check")
+                    return False
+
+                # Check if token is expired or will expire in next 5 minutes
+                if not connection.is_token_expired(buffer_seconds=TOKEN_REFRESH_BUFFER):
+                    logger.debug("Tokens still valid, no refresh needed")
+                    return True
+
+                # Refresh the tokens
+                logger.info("Access token expired or expiring soon, refreshing...")
+                auth_client.refresh()
+
+                # Save the new tokens
+                TokenService.save_tokens(auth_client, connection.company_name)
+
+                # Re-initialize the QBO client with new tokens (avoid recursive authenticate call)
+                if qbo_service.qb:
+                    from quickbooks import QuickBooks
+
+                    qbo_service.qb = QuickBooks(
+                        auth_client=auth_client,
+                        refresh_token=auth_client.refresh_token,
+                        company_id=auth_client.realm_id,
+                        minorversion=65,
+                    )
+
+                logger.info("Tokens refreshed successfully")
                 return True
 
-            # Refresh the tokens
-            logger.info("Access token expired or expiring soon, refreshing...")
-            auth_client.refresh()
-
-            # Save the new tokens
-            TokenService.save_tokens(auth_client, connection.company_name)
-
-            # Re-initialize the QBO client with new tokens (avoid recursive authenticate call)
-            if qbo_service.qb:
-                from quickbooks import QuickBooks
-
-                qbo_service.qb = QuickBooks(
-                    auth_client=auth_client,
-                    refresh_token=auth_client.refresh_token,
-                    company_id=auth_client.realm_id,
-                    minorversion=65,
-                )
-
-            logger.info("Tokens refreshed successfully")
-            return True
-
-        except Exception as e:
-            error_str = str(e)
-            logger.error(f"Error refreshing tokens: {error_str}")
-
-            # If refresh fails due to invalid/expired refresh token, clear tokens
-            # so user gets redirected to re-authenticate
-            if (
-                "401" in error_str
-                or "invalid_grant" in error_str.lower()
-                or "expired" in error_str.lower()
-            ):
-                logger.warning(
-                    "Refresh token invalid/expired - clearing tokens for re-auth"
-                )
-                auth_client.access_token = None
-                auth_client.refresh_token = None
+            except Exception as e:
+                error_str = str(e)
+                logger.error(f"Error refreshing tokens: {error_str}")
+
+                # If refresh fails due to invalid/expired refresh token, clear tokens
+                # so user gets redirected to re-authenticate
+                if (
+                    "401" in error_str
+                    or "invalid_grant" in error_str.lower()
+                    or "expired" in error_str.lower()
+                ):
+                    logger.warning(
+                        "Refresh token invalid/expired - clearing tokens for re-auth"
+                    )
+                    auth_client.access_token = None
+                    auth_client.refresh_token = None
 
-            return False
+                return False
 
     @staticmethod
     def delete_connection(realm_id: str) -> bool:
@@ -281,8 +284,6 @@ class TokenService:
             auth_client.realm_id = connection.realm_id
 
             # Update the connection's updated_at to make it the "current" one
-            from datetime import datetime, timezone
-
             connection.updated_at = datetime.now(timezone.utc)
             db.session.commit()
 
@@ -340,6 +341,38 @@ class TokenService:
             db.session.rollback()
             return 0
 
+    @staticmethod
+    def start_background_refresh(app, qbo_service, interval: int) -> threading.Thread:
+        """
+        Check the current connection every `interval` seconds and refresh its
+        tokens shortly before they expire, so requests rarely have to wait on
+        a refresh themselves.
+
+        The refresh lock only covers this process, so run the refresher in a
+        single-process deployment; with several workers each would hold its
+        own loop racing on the same refresh token.
+        """
+
+        def refresh_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    with app.app_context():
+                        auth_client = qbo_service.auth_client
+                        if auth_client is not None and auth_client.refresh_token:
+                            TokenService.refresh_tokens_if_needed(
+                                auth_client, qbo_service
+                            )
+                except Exception as e:
+                    logger.error(f"Background token refresh failed: {str(e)}")
+
+        thread = threading.Thread(
+            target=refresh_loop, name="qbo-token-refresh", daemon=True
+        )
+        thread.start()
+        logger.info(f"Background token refresh every {interval}s")
+        return thread
+
 
 # Module-level singleton
 token_service = TokenService()
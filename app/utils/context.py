@@ -0,0 +1,32 @@
+# File: app/utils/context.py
+"""
+/app/utils/context.py
+Per-request lookups of the current QBO company
+"""
+
+from typing import Optional
+from flask import g
+from app.models.qbo_connection import QBOConnection
+from app.services.qbo import qbo_service
+from app.services.token_service import token_service
+
+
+def current_realm_id() -> Optional[str]:
+    """Get the current realm_id from the QBO service, once per request"""
+    if "realm_id" not in g:
+        auth_client = qbo_service.auth_client
+        g.realm_id = (auth_client.realm_id if auth_client else None) or None
+    return g.realm_id
+
+
+def current_connection() -> Optional[QBOConnection]:
+    """Get the current QBO connection, loading it at most once per request"""
+    if "qbo_connection" not in g:
+        g.qbo_connection = token_service.get_connection()
+    return g.qbo_connection
+
+
+def forget_current_company():
+    """Drop the memoized realm and connection after the company changes"""
+    g.pop("realm_id", None)
+    g.pop("qbo_connection", None)
@@ -0,0 +1,38 @@
+# File: app/utils/json_provider.py
+"""
+/app/utils/json_provider.py
+orjson-backed JSON provider for Flask
+"""
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Drop-in replacement for Flask's JSON provider that serializes with orjson.
+    Output matches the default provider: keys are sorted and dates still go
+    through Flask's default handler (HTTP date format).
+    """
+
+    OPTIONS = (
+        orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._dumps(obj, indent=bool(kwargs.get("indent"))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serialize straight to bytes, skipping the str round trip"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self._dumps(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
+
+    def _dumps(self, obj, indent: bool = False) -> bytes:
+        option = self.OPTIONS | orjson.OPT_INDENT_2 if indent else self.OPTIONS
+        return orjson.dumps(obj, default=self.default, option=option)
@@ -7,7 +7,9 @@ Configuration management for the application
 import os
 import json
 import logging
+from datetime import timedelta
 from pathlib import Path
+from typing import ClassVar
 from dotenv import load_dotenv
 from cryptography.fernet import Fernet
 
@@ -34,6 +36,8 @@ class Config:
     # Flask
     SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "dev-secret-key-change-in-production")
     DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"  # Disabled by default
+    # Only stat template files for changes while developing
+    TEMPLATES_AUTO_RELOAD = DEBUG
 
     # Session Security
     SESSION_COOKIE_SECURE = (
@@ -41,6 +45,7 @@ class Config:
     )
     SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access to session cookie
     SESSION_COOKIE_SAMESITE = "Lax"  # CSRF protection for cookies
+    PERMANENT_SESSION_LIFETIME = timedelta(days=30)  # "Remember me" sessions
 
     # Encryption key for tokens at rest
     ENCRYPTION_KEY = get_or_generate_encryption_key()
@@ -53,21 +58,41 @@ class Config:
     QBO_CLIENT_SECRET = os.getenv("QBO_CLIENT_SECRET")
     QBO_REDIRECT_URI = os.getenv("QBO_REDIRECT_URI")
     QBO_ENVIRONMENT = os.getenv("QBO_ENVIRONMENT", "sandbox")
+    # Seconds between background token expiry checks (0 disables). The
+    # refresher runs in every worker process, so only enable it when the
+    # app runs as a single process.
+    TOKEN_REFRESH_INTERVAL = int(os.getenv("TOKEN_REFRESH_INTERVAL", "0"))
 
     # Server
     HOST = os.getenv("HOST", "0.0.0.0")
     PORT = int(os.getenv("PORT", "443"))
     SSL_CERT = os.getenv("SSL_CERT", "")  # Path to SSL certificate
     SSL_KEY = os.getenv("SSL_KEY", "")  # Path to SSL key
+    # Reverse proxies (or tunnels such as ngrok) in front of the app whose
+    # X-Forwarded-For/-Proto headers are trusted; 0 uses the socket address
+    TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
 
     # Logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # Drop the dev server's request logging entirely
+    DISABLE_WERKZEUG_LOG = os.getenv("DISABLE_WERKZEUG_LOG", "false").lower() == "true"
 
     # Database
     DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/journalsmart.db")
+    # Create missing tables at startup (disable when the schema is managed
+    # externally)
+    AUTO_CREATE_SCHEMA = os.getenv("AUTO_CREATE_SCHEMA", "true").lower() == "true"
 
     # SQLAlchemy configuration
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Adjusted to the database URL by create_app() (configure_engine_options)
+    SQLALCHEMY_ENGINE_OPTIONS: ClassVar[dict] = {
+        # Enough pooled connections for concurrent API requests
+        "pool_size": 10,
+        "max_overflow": 20,
+        # Pooled SQLite connections are shared across request threads
+        "connect_args": {"check_same_thread": False},
+    }
 
     @staticmethod
     def init_database_uri():